@@ -0,0 +1,178 @@
+"""
+auth.py
+
+Password hashing, login throttling and the cache of logged in users.
+
+Passwords are stored as salted scrypt hashes in werkzeug's format. scrypt
+is deliberately slow and memory hungry, so hashes are computed on a small
+pool of worker threads (scrypt runs outside the GIL) with a bounded queue
+in front of it: a burst of logins waits its turn or is turned away instead
+of tying up every core. LoginThrottle caps how often one client or one
+account may try, before any hashing is done.
+
+Accounts created before hashing have their plaintext password in the
+database; it is still accepted once and replaced by a hash on that login.
+"""
+
+# Imports
+import hmac
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from werkzeug.security import check_password_hash, generate_password_hash
+
+
+# Globals
+HASH_METHOD = "scrypt"
+HASH_PREFIXES = ("scrypt:", "pbkdf2:")
+# Leave cores free for requests that aren't logging in
+HASH_WORKERS = max(1, (os.cpu_count() or 1) // 2)
+# Hashes waiting for a worker before new ones are refused
+MAX_PENDING_HASHES = 8 * HASH_WORKERS
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+_pending = threading.BoundedSemaphore(MAX_PENDING_HASHES)
+_dummy_hash = None
+
+
+class HashQueueFull(Exception):
+    """ Raised when too many password hashes are already waiting. """
+
+
+def hash_pool():
+    """ Returns this process's hashing pool, starting it on first use. Threads don't survive a fork, so each worker gets its own. """
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix="password-hash")
+            _pool_pid = os.getpid()
+        return _pool
+
+
+def run_hashing(func, *args):
+    """ Runs func(*args) on the hashing pool and waits for its result. Raises HashQueueFull if the queue is full. """
+    if not _pending.acquire(blocking=False):
+        raise HashQueueFull
+    try:
+        future = hash_pool().submit(func, *args)
+    except BaseException:
+        _pending.release()
+        raise
+    future.add_done_callback(lambda done: _pending.release())
+    return future.result()
+
+
+def is_hashed(stored):
+    """ Returns whether a stored password is a hash rather than legacy plaintext. """
+    return stored.startswith(HASH_PREFIXES) and stored.count("$") == 2
+
+
+def hash_password(password):
+    """ Returns a salted hash of password for storing. Runs on the hashing pool. """
+    return run_hashing(generate_password_hash, password, HASH_METHOD)
+
+
+def needs_rehash(stored):
+    """ Returns whether a stored password should be replaced by a fresh hash. """
+    return not stored.startswith(HASH_METHOD + ":")
+
+
+def verify_password(stored, password):
+    """ Returns whether password matches the stored hash or legacy plaintext. Runs on the hashing pool. """
+    if not is_hashed(stored):
+        return hmac.compare_digest(stored.encode(), password.encode())
+    return run_hashing(check_password_hash, stored, password)
+
+
+def dummy_hash():
+    """ Returns a hash to check against for unknown usernames, so they take as long as real ones. """
+    global _dummy_hash
+    if _dummy_hash is None:
+        _dummy_hash = hash_password(os.urandom(16).hex())
+    return _dummy_hash
+
+
+class LoginThrottle:
+    """ Thread-safe sliding window limit of attempts per key, such as a client address or username. A limit of None allows every attempt. """
+
+    def __init__(self, limit, period):
+        self.limit = limit
+        self.period = period
+        self.attempts = {}
+        self.lock = threading.Lock()
+
+    def prune(self, key, now):
+        """ Drops key's attempts older than the window. Returns what is left. Must hold the lock. """
+        window = self.attempts.get(key)
+        if window is None:
+            return ()
+        while window and window[0] <= now - self.period:
+            window.popleft()
+        if not window:
+            del self.attempts[key]
+        return window
+
+    def allowed(self, key):
+        """ Returns whether key has attempts left in the current window. """
+        if self.limit is None:
+            return True
+        with self.lock:
+            return len(self.prune(key, time.monotonic())) < self.limit
+
+    def record(self, key):
+        """ Counts one attempt against key. """
+        if self.limit is None:
+            return
+        now = time.monotonic()
+        with self.lock:
+            self.prune(key, now)
+            self.attempts.setdefault(key, deque()).append(now)
+            # Keys that stop trying are only pruned when seen, so sweep them now and then
+            if len(self.attempts) > 10000:
+                for stale in list(self.attempts):
+                    self.prune(stale, now)
+
+    def reset(self, key):
+        """ Forgets key's attempts. """
+        with self.lock:
+            self.attempts.pop(key, None)
+
+
+class UserCache:
+    """ Thread-safe cache of loaded users by id. Entries expire after ttl seconds or when invalidated. """
+
+    def __init__(self, ttl, max_size=10000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, user_id, load):
+        """ Returns the cached user, calling load(user_id) on a miss or once it has expired. """
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(user_id)
+            if entry is not None and entry[0] > now:
+                return entry[1]
+
+        user = load(user_id)
+        if user is not None:
+            with self.lock:
+                self.entries[user_id] = (now + self.ttl, user)
+                self.entries.move_to_end(user_id)
+                while len(self.entries) > self.max_size:
+                    self.entries.popitem(last=False)
+        return user
+
+    def invalidate(self, user_id):
+        """ Drops one user so the next request loads them again. """
+        with self.lock:
+            self.entries.pop(user_id, None)
+
+    def clear(self):
+        """ Drops every user. """
+        with self.lock:
+            self.entries.clear()
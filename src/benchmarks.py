@@ -0,0 +1,219 @@
+"""
+benchmarks.py
+
+Repeatable micro- and macro-benchmarks for scoring, persistence and the
+dashboard. Everything runs in-process against a scratch database filled
+with ACFTs from synthetic_data.py's seeded generator, so two runs of the
+same commit on the same machine measure the same work. Results are written
+as JSON; keep the files from two commits to compare them:
+python3 benchmarks.py --output bench.json
+python3 benchmarks.py --quick
+"""
+
+# Imports
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+import synthetic_data
+
+
+# Globals
+SEED = 2022
+# Raw scores cycled through by the score_event benchmarks
+EVENT_INPUTS = {"DL": [140, 180, 200, 230, 250, 340],
+                "SPT": [6.5, 8.0, 9.4, 10.2, 11.0, 12.5],
+                "HRP": [10, 20, 30, 40, 50, 61],
+                "SDC": ["1:45", "1:58", "2:05", "2:30", "3:00", "3:33"],
+                "PLK": ["1:30", "2:00", "2:30", "3:00", "3:30", "1:10"],
+                "2MR": ["13:30", "15:00", "16:45", "18:00", "20:00", "22:00"]}
+TIMES = ["0:59", "1:05", "2:30", "13:30", "16:45", "22:00"]
+HISTORY_SIZES = (10, 1000, 100000)
+QUICK_HISTORY_SIZES = (10, 1000, 10000)
+DASHBOARD_USER_ROWS = 1000
+DASHBOARD_FORM = {"deadlift": "200", "spt": "9.5", "hrp": "40", "sdc_m": "1",
+                  "sdc_ss": "55", "plank_m": "2", "plank_ss": "30",
+                  "run_mm": "16", "run_ss": "45"}
+
+
+def measure(name, func, number, repeat=5):
+    """ Times repeat rounds of number calls to func. Returns a result dict with per-call seconds. """
+    func()  # warm up caches and lazy imports
+    rounds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        rounds.append((time.perf_counter() - start) / number)
+    return {"name": name, "number": number, "repeat": repeat,
+            "best": min(rounds), "median": statistics.median(rounds),
+            "mean": statistics.fmean(rounds), "ops_per_sec": 1 / min(rounds)}
+
+
+def cycle(values):
+    """ Returns a function that yields values round-robin, one per call. """
+    state = {"i": -1}
+
+    def next_value():
+        state["i"] = (state["i"] + 1) % len(values)
+        return values[state["i"]]
+    return next_value
+
+
+def synthetic_acfts(server, find_score, user_id, count):
+    """ Yields count scored synthetic ACFTs for one soldier as Acft rows, a chunk at a time. """
+    registry = server.score_tables.REGISTRY
+    soldiers = synthetic_data.make_soldiers(1, SEED)
+    ranges = synthetic_data.chart_ranges(registry.current())
+    for index, size in synthetic_data.chunk_sizes(count):
+        chunk = synthetic_data.make_chunk(index, size, soldiers, ranges, SEED)
+        scores, versions = synthetic_data.score_chunk(find_score, chunk, registry)
+        yield synthetic_data.acft_rows(chunk, scores, versions, user_id)
+
+
+def populate(server, find_score, username, count):
+    """ Adds a soldier with count scored synthetic ACFTs in one transaction, then rebuilds the soldier stats. """
+    server.add_user(username, username, "bench", 25, "M")
+    with server.orm.db_session:
+        user = server.User.get(username=username)
+        for rows in synthetic_acfts(server, find_score, user.id, count):
+            server.bulk_insert(server.Acft, server.ACFT_COLUMNS, rows)
+    server.rebuild_user_stats()
+
+
+def scoring_benchmarks(find_score, quick):
+    """ score_event for each event type and convert_to_seconds. """
+    number = 2000 if quick else 20000
+    results = []
+    for event, inputs in EVENT_INPUTS.items():
+        raw_score = cycle(inputs)
+        results.append(measure(f"score_event[{event}]",
+                               lambda: find_score.score_event(event, 25, "M", raw_score()),
+                               number))
+    time_value = cycle(TIMES)
+    results.append(measure("convert_to_seconds",
+                           lambda: find_score.convert_to_seconds(time_value()), number))
+    return results
+
+
+def persistence_benchmarks(server, find_score, quick):
+    """ add_score_record insert throughput and get_user_scores at several history sizes. """
+    results = []
+    server.add_user("bench_insert", "Insert", "bench", 25, "M")
+    # add_score_record takes the soldier by username; the user id column is skipped
+    rows = [row for chunk in synthetic_acfts(server, find_score, 0, 200 if quick else 1000)
+            for row in chunk]
+    row = cycle(rows)
+
+    def insert():
+        r = row()
+        server.add_score_record(r[0], "bench_insert", *r[2:-1], standards_version=r[-1])
+    results.append(measure("add_score_record", insert, len(rows) // 5))
+
+    for size in (QUICK_HISTORY_SIZES if quick else HISTORY_SIZES):
+        username = f"bench_history_{size}"
+        populate(server, find_score, username, size)
+        number = max(1, min(200, 20000 // size))
+        results.append(measure(f"get_user_scores[{size}]",
+                               lambda: server.get_user_scores(username), number,
+                               repeat=3 if size >= 10000 else 5))
+    return results
+
+
+def dashboard_benchmarks(server, find_score, quick):
+    """ Full /dashboard GET and POST round trips through the Flask test client. """
+    populate(server, find_score, "bench_dashboard", DASHBOARD_USER_ROWS)
+    server.app.config["TESTING"] = True
+    client = server.app.test_client()
+    client.post("/login", data={"username": "bench_dashboard", "password": "bench"})
+
+    def get():
+        response = client.get("/dashboard")
+        assert response.status_code == 200
+
+    def get_cold():
+        # Renders the fragments from the soldier's history, as on the first view after a save
+        server.DASHBOARD_CACHE.clear()
+        get()
+
+    def post():
+        response = client.post("/dashboard", data=DASHBOARD_FORM)
+        assert response.status_code == 302
+
+    number = 50 if quick else 200
+    return [measure(f"dashboard_get[{DASHBOARD_USER_ROWS}]", get_cold, number),
+            measure(f"dashboard_get_cached[{DASHBOARD_USER_ROWS}]", get, number),
+            measure(f"dashboard_post[{DASHBOARD_USER_ROWS}]", post, number)]
+
+
+def startup_benchmarks(scratch, quick):
+    """ Cold start of a fresh process importing server and running create_app, as startup_report.py measures it. """
+    import startup_report
+    db_path = os.path.join(scratch, "startup.db")
+    startup_report.run_startup(db_path)
+    rounds = []
+    for _ in range(3 if quick else 5):
+        timings, _ = startup_report.run_startup(db_path)
+        rounds.append(timings["import"] + timings["create_app"])
+    return [{"name": "startup", "number": 1, "repeat": len(rounds),
+             "best": min(rounds), "median": statistics.median(rounds),
+             "mean": statistics.fmean(rounds), "ops_per_sec": 1 / min(rounds)}]
+
+
+def git_commit():
+    """ Returns the current git commit, or None outside a checkout. """
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    """ Entrypoint of program. """
+    parser = argparse.ArgumentParser(description="ACFT Calculator benchmarks")
+    parser.add_argument("--output", help="write the JSON results here instead of stdout")
+    parser.add_argument("--quick", action="store_true",
+                        help="fewer iterations and a 10k row history instead of 100k")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as scratch:
+        # The database file is fixed when server is imported
+        os.environ["ACFT_DB"] = os.path.join(scratch, "bench.db")
+        started = time.perf_counter()
+        startup = startup_benchmarks(scratch, args.quick)
+        import find_score
+        import server
+        server.app.secret_key = "benchmark"
+        # The app finds templates/ and static/ from the working directory, so point it at src/
+        server.app.root_path = os.path.dirname(os.path.abspath(server.__file__))
+        server.create_app()
+        results = (startup
+                   + scoring_benchmarks(find_score, args.quick)
+                   + persistence_benchmarks(server, find_score, args.quick)
+                   + dashboard_benchmarks(server, find_score, args.quick))
+        server.db.disconnect()
+
+    report = {"commit": git_commit(),
+              "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+              "python": platform.python_version(), "platform": platform.platform(),
+              "quick": args.quick, "seed": SEED,
+              "elapsed": time.perf_counter() - started,
+              "benchmarks": results}
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(text + "\n")
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,134 @@
+"""
+bulk_import.py
+
+Streams a roster CSV of ACFT results, validates each row with the shared
+schema in validation.py and scores the valid rows in batches with
+find_score.score_batch. The database side of the import lives in server.py.
+
+Roster columns (header row required, any order):
+username, dl, spt, hrp, sdc, plank, run - required, times as m:ss
+date, age, gender - optional, default to today and the user's profile
+"""
+
+# Imports
+import csv
+from datetime import date
+import find_score
+import score_tables
+import validation
+
+
+# Globals
+REQUIRED_COLUMNS = ("username", "dl", "spt", "hrp", "sdc", "plank", "run")
+BATCH_SIZE = 1000
+# Columns that may be left blank, defaulting to today and the soldier's profile
+OPTIONAL_FIELDS = (validation.DATE_FIELD,) + validation.SOLDIER_FIELDS
+# Roster rows fail with the shared validation error
+RowError = validation.ValidationError
+
+
+class RosterError(Exception):
+    """ Raised when the roster file itself can't be read, such as text that isn't UTF-8. Nothing from it should be imported. """
+
+    def __init__(self, line, message):
+        super().__init__(f"Line {line}: {message}")
+        self.line = line
+
+
+def unreadable(reader, error):
+    """ Returns the RosterError for a decoding or CSV error raised while reader fetched its next line. """
+    # line_num counts the lines read before the one that failed
+    if isinstance(error, UnicodeDecodeError):
+        return RosterError(reader.line_num + 1, "Not valid UTF-8 text.")
+    return RosterError(reader.line_num + 1, f"Unreadable CSV: {error}.")
+
+
+def decode_lines(stream, encoding="utf-8-sig"):
+    """ Decodes an uploaded binary roster one line at a time, so a decoding error is reported on the line it is in. """
+    # utf-8-sig drops the byte order mark Excel puts before the header row
+    for line in stream:
+        yield line.decode(encoding)
+
+
+def parse_row(row):
+    """ Validates one roster row and returns it as a record dict, with times in seconds and split into their Acft columns. """
+    username = row["username"].strip()
+    if not username:
+        raise RowError("Missing username.")
+
+    record = validation.validate(row, validation.RESULT_FIELDS, OPTIONAL_FIELDS)
+    record["username"] = username
+    if record["date"] is None:
+        record["date"] = str(date.today())
+    record.update(validation.time_columns(record))
+    return record
+
+
+def read_batches(lines, batch_size=BATCH_SIZE):
+    """
+    Streams roster lines and yields (records, rejected) batches. records is a
+    list of (line number, record dict); rejected is a list of
+    (line number, error message). Raises RosterError if the file can't be
+    read past some line.
+    """
+    reader = csv.DictReader(lines)
+    try:
+        fieldnames = reader.fieldnames
+    except (UnicodeDecodeError, csv.Error) as error:
+        raise unreadable(reader, error)
+    missing = [name for name in REQUIRED_COLUMNS
+               if name not in (fieldnames or ())]
+    if missing:
+        yield [], [(1, "Missing columns: " + ", ".join(missing))]
+        return
+
+    records = []
+    rejected = []
+    rows = iter(reader)
+    while True:
+        try:
+            row = next(rows)
+        except StopIteration:
+            break
+        except (UnicodeDecodeError, csv.Error) as error:
+            raise unreadable(reader, error)
+        try:
+            records.append((reader.line_num, parse_row(row)))
+        except RowError as error:
+            rejected.append((reader.line_num, str(error)))
+        except (TypeError, AttributeError):
+            # A row with too few cells leaves None in the missing columns
+            rejected.append((reader.line_num, "Malformed row."))
+        if len(records) + len(rejected) >= batch_size:
+            yield records, rejected
+            records = []
+            rejected = []
+
+    if records or rejected:
+        yield records, rejected
+
+
+def score_records(records):
+    """ Scores a batch of complete records against the standards in effect on each record's date and adds their per-event points, overall_score and standards_version. """
+    registry = score_tables.REGISTRY
+    groups = {}
+    for record in records:
+        groups.setdefault(registry.for_date(record["date"]).version, []).append(record)
+
+    for version, group in groups.items():
+        scores = find_score.score_batch(
+            [record["age"] for record in group],
+            [record["gender"] for record in group],
+            [record["dl"] for record in group],
+            [record["spt"] for record in group],
+            [record["hrp"] for record in group],
+            [record["sdc"] for record in group],
+            [record["plank"] for record in group],
+            [record["run"] for record in group],
+            registry.by_version[version])
+        for event, key in score_tables.POINT_COLUMNS.items():
+            for record, points in zip(group, scores[event].tolist()):
+                record[key] = points
+        for record, total in zip(group, scores["total"].tolist()):
+            record["overall_score"] = total
+            record["standards_version"] = version
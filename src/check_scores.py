@@ -0,0 +1,132 @@
+"""
+check_scores.py
+
+Differential check of the score lookups. find_score.score_event (dense
+tables) and find_score.lookup_score (binary search) are both checked
+against the linear column scans in score_event_number and score_event_time.
+Every chart, sex and age range is walked from below its 0-point value to
+above its 100-point value, including the in-between raw scores that have to
+round down. Finally a seeded random roster is scored with
+find_score.score_batch and compared row by row with score_event.
+
+Run from the src/ directory:
+python3 check_scores.py
+"""
+
+# Imports
+import random
+import sys
+import find_score
+import score_tables
+
+
+# Globals
+# Representative age for each age range in the charts.
+AGE_FOR_RANGE = {"17-21": 17, "22-26": 22, "27-31": 27, "32-36": 32, "37-41": 37,
+                 "42-46": 42, "47-51": 47, "52-56": 52, "57-61": 57, "62+": 62}
+TIMED_EVENTS = ("SDC", "PLK", "2MR")
+# Raw score ranges (seconds for timed events) that cover every chart.
+RANDOM_RANGES = {"DL": (50, 360), "SPT": (1.5, 14.0), "HRP": (0, 70),
+                 "SDC": (80, 360), "PLK": (30, 230), "2MR": (780, 1640)}
+BATCH_SIZE = 20000
+
+
+def candidate_scores(event, column):
+    """ Returns every raw score worth checking for one chart column. """
+    # SPT is charted in tenths of a meter, everything else in whole units
+    step = 0.1 if event == "SPT" else 1
+    low = int(round(min(column.thresholds) / step)) - 5
+    high = int(round(max(column.thresholds) / step)) + 5
+
+    scores = []
+    for i in range(low, high + 1):
+        scores.append(round(i * step, 1))
+        if event == "SPT":
+            scores.append(round(i * step + 0.05, 2))
+    return scores
+
+
+def linear_score(event, age, sex, raw_score):
+    """ Scores a result with the linear column scans. """
+    if event in TIMED_EVENTS:
+        return find_score.score_event_time(event, age, sex, raw_score)
+    return find_score.score_event_number(event, age, sex, raw_score)
+
+
+def seconds_to_time(seconds):
+    """ Formats seconds as the m:ss string score_event expects. """
+    return f"{seconds // 60}:{seconds % 60:02d}"
+
+
+def check_batch():
+    """ Scores a random roster with score_batch and compares every row. """
+    rng = random.Random(0)
+    ages = [rng.randint(17, 75) for _ in range(BATCH_SIZE)]
+    sexes = [rng.choice("MF") for _ in range(BATCH_SIZE)]
+    raw_scores = {}
+    for event, (low, high) in RANDOM_RANGES.items():
+        if event == "SPT":
+            raw_scores[event] = [round(rng.uniform(low, high), 2)
+                                 for _ in range(BATCH_SIZE)]
+        else:
+            raw_scores[event] = [rng.randint(low, high)
+                                 for _ in range(BATCH_SIZE)]
+
+    batch = find_score.score_batch(ages, sexes, raw_scores["DL"], raw_scores["SPT"],
+                                   raw_scores["HRP"], raw_scores["SDC"],
+                                   raw_scores["PLK"], raw_scores["2MR"])
+
+    mismatches = []
+    for row in range(BATCH_SIZE):
+        total = 0
+        for event in score_tables.EVENTS:
+            raw_score = raw_scores[event][row]
+            if event in TIMED_EVENTS:
+                raw_score = seconds_to_time(raw_score)
+            expected = find_score.score_event(event, ages[row], sexes[row], raw_score)
+            total += expected
+            if batch[event][row] != expected:
+                mismatches.append((row, event, raw_score,
+                                   expected, batch[event][row]))
+        if batch["total"][row] != total:
+            mismatches.append((row, "total", "", total, batch["total"][row]))
+
+    for mismatch in mismatches:
+        print("MISMATCH row %s %s raw=%s score_event=%s batch=%s" % mismatch)
+    print(f"Checked {BATCH_SIZE} batch rows, {len(mismatches)} mismatches.")
+    return mismatches
+
+
+def main():
+    """ Entrypoint of program. """
+    checked = 0
+    mismatches = []
+    for (event, sex), chart in score_tables.current().charts.items():
+        for age_range, column in chart.items():
+            age = AGE_FOR_RANGE[age_range]
+            for raw_score in candidate_scores(event, column):
+                if event in TIMED_EVENTS:
+                    raw_score = seconds_to_time(int(raw_score))
+                expected = linear_score(event, age, sex, raw_score)
+                dense = find_score.score_event(event, age, sex, raw_score)
+                if event in TIMED_EVENTS:
+                    numeric_score = find_score.convert_to_seconds(raw_score)
+                else:
+                    numeric_score = raw_score
+                bisect = find_score.lookup_score(
+                    event, age_range, sex, numeric_score)
+                checked += 1
+                if not expected == dense == bisect:
+                    mismatches.append((event, sex, age_range, raw_score,
+                                       expected, bisect, dense))
+
+    for mismatch in mismatches:
+        print("MISMATCH %s %s %s raw=%s linear=%s bisect=%s dense=%s" % mismatch)
+    print(f"Checked {checked} scores, {len(mismatches)} mismatches.")
+
+    batch_mismatches = check_batch()
+    return 1 if mismatches or batch_mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,64 @@
+"""
+downsample.py
+
+Largest-Triangle-Three-Buckets (LTTB) downsampling for the score-over-time
+chart. LTTB keeps the first and last points and, from each bucket in
+between, the point that forms the largest triangle with its neighbours, so
+peaks, dips and the overall trend survive while the number of points drops
+to a fixed cap.
+"""
+
+
+def lttb(xs, ys, threshold):
+    """ Returns the indexes of at most threshold points of (xs, ys) chosen by LTTB. xs must be sorted. """
+    count = len(xs)
+    if count <= threshold:
+        return list(range(count))
+    if threshold < 3:
+        # Too few points to form a triangle, so just keep the ends
+        return [0, count - 1][:max(threshold, 0)]
+
+    selected = [0]
+    bucket_size = (count - 2) / (threshold - 2)
+    previous = 0
+
+    for bucket in range(threshold - 2):
+        start = int(bucket * bucket_size) + 1
+        end = int((bucket + 1) * bucket_size) + 1
+
+        # Average of the next bucket is the third corner of the triangle
+        next_start = end
+        next_end = min(int((bucket + 2) * bucket_size) + 1, count)
+        if next_start >= next_end:
+            next_start, next_end = count - 1, count
+        span = next_end - next_start
+        average_x = sum(xs[next_start:next_end]) / span
+        average_y = sum(ys[next_start:next_end]) / span
+
+        previous_x = xs[previous]
+        previous_y = ys[previous]
+        best_area = -1
+        best = start
+        for i in range(start, end):
+            area = abs((previous_x - average_x) * (ys[i] - previous_y)
+                       - (previous_x - xs[i]) * (average_y - previous_y))
+            if area > best_area:
+                best_area = area
+                best = i
+
+        selected.append(best)
+        previous = best
+
+    selected.append(count - 1)
+    return selected
+
+
+def downsample_series(labels, values, max_points, positions=None):
+    """ Caps a chart series at max_points with LTTB. positions are the numeric x values, defaulting to the point index. """
+    if len(labels) <= max_points:
+        return list(labels), list(values)
+    if positions is None:
+        positions = range(len(labels))
+
+    keep = lttb(list(positions), list(values), max_points)
+    return [labels[i] for i in keep], [values[i] for i in keep]
@@ -0,0 +1,107 @@
+"""
+export.py
+
+Columnar exports of ACFT results for analysis outside the app. The
+database side lives in server.py, which reads the Acft table through one
+cursor a chunk at a time; each chunk becomes one row group of a Parquet
+file (or one record batch of an Arrow IPC file), so memory use depends on
+EXPORT_CHUNK_SIZE and not on how many results are exported. Both formats
+are zstd compressed.
+
+pyarrow is only needed for exports, so it is imported on first use and the
+rest of the app runs without it:
+pip install pyarrow
+
+Reading an export back:
+table = export.open_export("acft.parquet", columns=["date", "unit", "overall_score"])
+frame = table.to_pandas()
+"""
+
+# Imports
+import os
+
+
+# Globals
+# Rows read from the database and written out at a time
+EXPORT_CHUNK_SIZE = 50000
+COMPRESSION = "zstd"
+# Output format of each file extension; anything else is written as Parquet
+FORMATS = {".parquet": "parquet", ".arrow": "arrow", ".feather": "arrow"}
+# Column name and pyarrow type, in the order the export query selects them.
+# Times are whole seconds; points are None on rows saved before they were kept.
+EXPORT_COLUMNS = (("id", "int64"), ("date", "date32"), ("user", "int64"),
+                  ("username", "string"), ("unit", "int64"), ("age", "int16"),
+                  ("gender", "string"), ("dl", "int32"), ("spt", "float64"),
+                  ("hrp", "int32"), ("sdc", "int32"), ("plank", "int32"),
+                  ("run", "int32"), ("overall_score", "int32"),
+                  ("dl_points", "int16"), ("spt_points", "int16"), ("hrp_points", "int16"),
+                  ("sdc_points", "int16"), ("plank_points", "int16"), ("run_points", "int16"),
+                  ("standards_version", "string"))
+
+
+class ExportUnavailable(Exception):
+    """ Raised when pyarrow, which exports need, is not installed. """
+
+
+def require_pyarrow():
+    """ Imports and returns pyarrow with its Parquet and IPC modules loaded. Raises ExportUnavailable without it. """
+    try:
+        import pyarrow
+        import pyarrow.ipc
+        import pyarrow.parquet
+    except ImportError:
+        raise ExportUnavailable("Exports need pyarrow: pip install pyarrow")
+    return pyarrow
+
+
+def format_of(path):
+    """ Returns the export format for a file name from its extension. """
+    return FORMATS.get(os.path.splitext(path)[1].lower(), "parquet")
+
+
+def export_schema(pa):
+    """ Returns the pyarrow schema of EXPORT_COLUMNS. """
+    return pa.schema([(name, getattr(pa, kind)()) for name, kind in EXPORT_COLUMNS])
+
+
+def record_batch(pa, schema, rows):
+    """ Turns a chunk of row tuples, in EXPORT_COLUMNS order, into a record batch one column at a time. """
+    arrays = []
+    for field, values in zip(schema, zip(*rows)):
+        if pa.types.is_date32(field.type):
+            # Dates are stored as YYYY-MM-DD text
+            arrays.append(pa.array(values, pa.string()).cast(field.type))
+        else:
+            arrays.append(pa.array(values, field.type))
+    return pa.record_batch(arrays, schema=schema)
+
+
+def write_export(chunks, sink, fmt="parquet"):
+    """ Writes an iterable of row chunks to sink, a path or binary file, as Parquet or Arrow IPC. Returns the number of rows written. """
+    pa = require_pyarrow()
+    schema = export_schema(pa)
+    if fmt == "arrow":
+        writer = pa.ipc.new_file(sink, schema,
+                                 options=pa.ipc.IpcWriteOptions(compression=COMPRESSION))
+    else:
+        writer = pa.parquet.ParquetWriter(sink, schema, compression=COMPRESSION)
+
+    written = 0
+    try:
+        for rows in chunks:
+            if rows:
+                writer.write_batch(record_batch(pa, schema, rows))
+                written += len(rows)
+    finally:
+        writer.close()
+    return written
+
+
+def open_export(path, columns=None):
+    """ Memory-maps an export file and returns it, or just the named columns, as a pyarrow Table. The file's pages are read by the OS as columns are used instead of being copied in up front. """
+    pa = require_pyarrow()
+    if format_of(path) == "arrow":
+        with pa.ipc.open_file(pa.memory_map(path)) as reader:
+            table = reader.read_all()
+        return table.select(columns) if columns is not None else table
+    return pa.parquet.read_table(path, columns=columns, memory_map=True)
@@ -4,7 +4,18 @@ Created on Mon Oct 24 11:48:57 2022
 
 @author: MaryClare
 """
-import pandas as pd
+from bisect import bisect_left, bisect_right
+import logging
+import score_cache
+import score_tables
+
+logger = logging.getLogger(__name__)
+# First age of each age range in the charts, for vectorized age lookups.
+AGE_RANGE_STARTS = (17, 22, 27, 32, 37, 42, 47, 52, 57, 62)
+MIN_AGE = 17
+MAX_AGE = 75
+# (chart digest, event, sex, age range, raw key) -> points for score_event
+SCORE_CACHE = score_cache.LRUCache()
 
 
 def grab_age_range(age):
@@ -34,7 +45,7 @@ def grab_age_range(age):
     if age >= 62 and age <= 75:
         return "62+"
     else:
-        print("ERROR in AGE RANGE")
+        logger.warning("Age %s is outside every chart age range.", age)
         return None
 
 
@@ -43,38 +54,11 @@ def grab_event_file_sex(event, sex):
     @brief Grabs the corresponding csv file for the user
     @param event - the fitness event
     @param sex - gender of the user
-    @return ACFT CSV file 
-    """
-    if event == "DL":
-        if sex == "M":
-            return "../include/DL_M.csv"
-        elif sex == "F":
-            return "../include/DL_F.csv"
-    if event == "SPT":
-        if sex == "M":
-            return "../include/SPT_M.csv"
-        elif sex == "F":
-            return "../include/SPT_F.csv"
-    if event == "HRP":
-        if sex == "M":
-            return "../include/HRP_M.csv"
-        elif sex == "F":
-            return "../include/HRP_F.csv"
-    if event == "SDC":
-        if sex == "M":
-            return "../include/SDC_M.csv"
-        elif sex == "F":
-            return "../include/SDC_F.csv"
-    if event == "PLK":
-        if sex == "M":
-            return "../include/PLK_M.csv"
-        elif sex == "F":
-            return "../include/PLK_F.csv"
-    if event == "2MR":
-        if sex == "M":
-            return "../include/2MR_M.csv"
-        elif sex == "F":
-            return "../include/2MR_F.csv"
+    @return ACFT CSV file of the standards in effect today
+    """
+    if event not in score_tables.EVENTS or sex not in score_tables.SEXES:
+        return None
+    return score_tables.chart_path(event, sex, score_tables.current().directory)
 
 
 def handle_intermediate_score_number(rawscore_column, Points_column, raw_score):
@@ -85,9 +69,7 @@ def handle_intermediate_score_number(rawscore_column, Points_column, raw_score):
     @param raw_score - raw score user got on this event 
     """
     for val in range(len(rawscore_column)):
-        if rawscore_column[val] == "---":
-            next
-        elif float(rawscore_column[val]) < raw_score:
+        if rawscore_column[val] < raw_score:
             return val
 
 
@@ -99,34 +81,26 @@ def handle_intermediate_score_time(rawscore_column, Points_column, raw_score):
     @param raw_score - raw score user got on this timed event 
     """
     for val in range(len(rawscore_column)):
-        if rawscore_column[val] == "---":
-            next
-        elif float(rawscore_column[val]) > raw_score:
+        if rawscore_column[val] > raw_score:
             return val
 
 
 def convert_to_seconds(raw_score):
     """
-    @brief converts a timed events raw score into seconds 
-    @return the score in seconds 
-    """
-    print(raw_score)
-    separator = raw_score.find(':')
-    final_seconds = -1
-    minutes = 0
-    seconds = 0
-    if separator == 2:
-        if raw_score[0] == "0":
-            minutes = int(raw_score[1])
-        else:
-            minutes = int(raw_score[:2])
-        seconds = int(raw_score[3:])
-        final_seconds = minutes*60 + seconds
-    elif separator == 1:
-        minutes = int(raw_score[0])
-        seconds = int(raw_score[2:])
-        final_seconds = minutes*60 + seconds
-    return final_seconds
+    @brief converts a timed events raw score into seconds
+    @param raw_score - an m:ss string (any number of minutes, seconds 0-59) or a whole number of seconds
+    @return the score in seconds
+    @raise ValueError if raw_score is not a valid time
+    """
+    if isinstance(raw_score, int) and not isinstance(raw_score, bool):
+        if raw_score < 0:
+            raise ValueError(f"Negative time {raw_score!r}.")
+        return raw_score
+    minutes, separator, seconds = str(raw_score).strip().partition(":")
+    if (not separator or not minutes.isdigit() or not seconds.isdigit()
+            or len(seconds) > 2 or int(seconds) > 59):
+        raise ValueError(f"Invalid time {raw_score!r}.")
+    return int(minutes) * 60 + int(seconds)
 
 
 def score_event_number(event, age, sex, raw_score):
@@ -138,36 +112,37 @@ def score_event_number(event, age, sex, raw_score):
     @param raw score - score of fitness event before it's calculated into a point value
     @return - calculated point value for this fitness event 
     """
-    # Grab correct file based on sex and grab correct age range
-    csv_path = grab_event_file_sex(event, sex)
+    # Grab correct chart column based on sex and age range
     age_range = grab_age_range(age)
+    column = score_tables.get_column(event, sex, age_range)
 
     final_score = -1
 
-    # Grab DL and Points columns for information
-    csv_read = pd.read_csv(csv_path)
-    rawscore_column = csv_read[age_range]
-    Points_column = csv_read['Points']
+    # Grab raw score and Points columns for information
+    rawscore_column = column.thresholds
+    Points_column = column.points
+
+    raw_score = float(raw_score)
 
     # Find raw score in age column and find points that correspond
     point_location = -1
     for val in range(len(rawscore_column)):
-        if rawscore_column[val] == str(raw_score):
+        if rawscore_column[val] == raw_score:
             point_location = val
             break
 
     if point_location == -1:
         # Handle greater than Max value
-        if float(rawscore_column[0]) < raw_score:
-            print("Soldier exceeded standard! MAX score!")
+        if rawscore_column[0] < raw_score:
+            logger.debug("Soldier exceeded standard! MAX score!")
             point_location = 0
         # Handle less than Min value
-        elif float(rawscore_column[len(rawscore_column)-1]) > raw_score:
-            print("Soldier did not meet minimum standard.")
+        elif rawscore_column[len(rawscore_column)-1] > raw_score:
+            logger.debug("Soldier did not meet minimum standard.")
             point_location = len(rawscore_column) - 1
         # Handle an intermediate value
         else:
-            print("Soldier had an intermediate value. Round down for score.")
+            logger.debug("Soldier had an intermediate value. Round down for score.")
             point_location = handle_intermediate_score_number(
                 rawscore_column, Points_column, raw_score)
 
@@ -185,16 +160,15 @@ def score_event_time(event, age, sex, raw_score):
     @param raw score - score of fitness event before it's calculated into a point value
     @return - calculated point value for this fitness event 
     """
-    # Grab correct file based on sex and grab correct age range
-    csv_path = grab_event_file_sex(event, sex)
+    # Grab correct chart column based on sex and age range
     age_range = grab_age_range(age)
+    column = score_tables.get_column(event, sex, age_range)
 
     final_score = -1
 
-    # Grab DL and Points columns for information
-    csv_read = pd.read_csv(csv_path)
-    rawscore_column = csv_read[age_range]
-    Points_column = csv_read['Points']
+    # Grab raw score and Points columns for information
+    rawscore_column = column.thresholds
+    Points_column = column.points
 
     raw_score = convert_to_seconds(raw_score)
 
@@ -207,31 +181,31 @@ def score_event_time(event, age, sex, raw_score):
     if event == "PLK":
         if point_location == -1:
             # Handle greater than Max value
-            if float(rawscore_column[0]) < raw_score:
-                print("Soldier exceeded standard! MAX score!")
+            if rawscore_column[0] < raw_score:
+                logger.debug("Soldier exceeded standard! MAX score!")
                 point_location = 0
             # Handle less than Min value
-            elif float(rawscore_column[len(rawscore_column)-1]) > raw_score:
-                print("Soldier did not meet minimum standard.")
+            elif rawscore_column[len(rawscore_column)-1] > raw_score:
+                logger.debug("Soldier did not meet minimum standard.")
                 point_location = len(rawscore_column) - 1
             # Handle an intermediate value
             else:
-                print("Soldier had an intermediate value. Round down for score.")
+                logger.debug("Soldier had an intermediate value. Round down for score.")
                 point_location = handle_intermediate_score_number(
                     rawscore_column, Points_column, raw_score)
     else:
         if point_location == -1:
             # Handle greater than Max value
-            if float(rawscore_column[0]) > raw_score:
-                print("Soldier exceeded standard! MAX score!")
+            if rawscore_column[0] > raw_score:
+                logger.debug("Soldier exceeded standard! MAX score!")
                 point_location = 0
             # Handle less than Min value
-            elif float(rawscore_column[len(rawscore_column)-1]) < raw_score:
-                print("Soldier did not meet minimum standard.")
+            elif rawscore_column[len(rawscore_column)-1] < raw_score:
+                logger.debug("Soldier did not meet minimum standard.")
                 point_location = len(rawscore_column) - 1
                 # Handle an intermediate value
             else:
-                print("Soldier had an intermediate value. Round down for score.")
+                logger.debug("Soldier had an intermediate value. Round down for score.")
                 point_location = handle_intermediate_score_time(
                     rawscore_column, Points_column, raw_score)
 
@@ -240,12 +214,132 @@ def score_event_time(event, age, sex, raw_score):
     return final_score
 
 
-def score_event(event, age, sex, raw_score):
+def lookup_score(event, age_range, sex, raw_score, standards=None):
+    """
+    @brief finds the points for a numeric raw score with a binary search over the chart thresholds
+    @param event - pt event
+    @param age_range - age range string from grab_age_range
+    @param sex - gender of user
+    @param raw_score - raw score as a number (seconds for timed events)
+    @param standards - score_tables.Standards to use, defaults to the current ones
+    @return - calculated point value for this fitness event
+    """
+    if standards is None:
+        standards = score_tables.current()
+    column = standards.get_column(event, sex, age_range)
+    thresholds = column.sorted_thresholds
+    points = column.sorted_points
+
+    if event in score_tables.LOWER_IS_BETTER:
+        # Slowest threshold the time still beats; past the last one is 0 points
+        location = bisect_left(thresholds, raw_score)
+        if location == len(thresholds):
+            location = len(thresholds) - 1
+    else:
+        # Highest threshold the score reaches; under the first one is 0 points
+        location = bisect_right(thresholds, raw_score) - 1
+        if location < 0:
+            location = 0
+
+    return points[location]
+
+
+def score_event(event, age, sex, raw_score, standards=None):
     """
     @brief breaks down pt events into timed and number score events 
+    @param raw_score - a number, or for timed events seconds or an m:ss string
+    @param standards - score_tables.Standards to score against, defaults to the current ones
     @returns the score for the event 
     """
     if event == "SDC" or event == "2MR" or event == "PLK":
-        return score_event_time(event, age, sex, raw_score)
+        raw_score = convert_to_seconds(raw_score)
     elif event == "DL" or event == "HRP" or event == "SPT":
-        return score_event_number(event, age, sex, raw_score)
+        raw_score = float(raw_score)
+    else:
+        return None
+    if standards is None:
+        standards = score_tables.current()
+    age_range = grab_age_range(age)
+    key = (standards.digest, event, sex, age_range, score_tables.raw_key(event, raw_score))
+    return SCORE_CACHE.get(key, lambda: standards.dense_tables.points(
+        event, sex, age_range, raw_score))
+
+
+def batch_event_points(event, sex_index, age_index, raw_scores, tables):
+    """
+    @brief scores one event for a whole batch of soldiers with array indexing
+    @param event - pt event
+    @param sex_index - array of 0 for M and 1 for F
+    @param age_index - array of positions in score_tables.AGE_RANGES
+    @param raw_scores - array of raw scores (seconds for timed events)
+    @param tables - score_tables.DenseTables to look the points up in
+    @return - array of point values
+    """
+    import numpy as np
+    data = np.frombuffer(tables.buffer, dtype=np.uint8)
+
+    # Lowest key, highest key and data offset for every sex and age range
+    grid = np.array([[tables.index[(event, sex, age_range)]
+                      for age_range in score_tables.AGE_RANGES]
+                     for sex in score_tables.SEXES], dtype=np.int64)
+    low = grid[sex_index, age_index, 0]
+    high = grid[sex_index, age_index, 1]
+    start = grid[sex_index, age_index, 2]
+
+    scaled = np.round(np.asarray(raw_scores, dtype=np.float64)
+                      * score_tables.RAW_SCALE.get(event, 1), 6)
+    if not np.all(np.isfinite(scaled)):
+        raise ValueError(f"Invalid {event} raw score in batch.")
+    if event in score_tables.LOWER_IS_BETTER:
+        keys = np.ceil(scaled).astype(np.int64)
+    else:
+        keys = np.floor(scaled).astype(np.int64)
+
+    return data[start + np.clip(keys, low, high) - low]
+
+
+def score_batch(age, sex, dl, spt, hrp, sdc, plank, run, standards=None):
+    """
+    @brief scores a whole unit's ACFT results at once without a per-soldier loop
+    @param age - array of soldier ages
+    @param sex - array of "M" or "F"
+    @param dl, spt, hrp - arrays of raw scores (pounds, meters, reps)
+    @param sdc, plank, run - arrays of raw times in seconds
+    @param standards - score_tables.Standards to score against, defaults to the current ones
+    @return - dict of event -> array of points, plus "total" -> array of overall scores
+    """
+    # Imported on the first batch rather than at startup, which only scores single results
+    import numpy as np
+    if standards is None:
+        standards = score_tables.current()
+    age = np.asarray(age)
+    sex = np.asarray(sex)
+    if np.any(age != np.floor(age)) or np.any(age < MIN_AGE) or np.any(age > MAX_AGE):
+        raise ValueError("Invalid age in batch.")
+    if not np.all((sex == "M") | (sex == "F")):
+        raise ValueError("Invalid sex in batch.")
+
+    age_index = np.searchsorted(AGE_RANGE_STARTS, age, side="right") - 1
+    sex_index = np.where(sex == "M", 0, 1)
+
+    raw_scores = {"DL": dl, "SPT": spt, "HRP": hrp,
+                  "SDC": sdc, "PLK": plank, "2MR": run}
+    scores = {}
+    total = np.zeros(len(age), dtype=np.int64)
+    for event in score_tables.EVENTS:
+        scores[event] = batch_event_points(
+            event, sex_index, age_index, raw_scores[event], standards.dense_tables)
+        total += scores[event]
+    scores["total"] = total
+
+    return scores
+
+
+def score_frame(frame):
+    """
+    @brief scores a table of results, such as a DataFrame or a dict of arrays
+    @param frame - columns age, gender, dl, spt, hrp, sdc, plank and run (times in seconds)
+    @return - dict of event -> array of points, plus "total"
+    """
+    return score_batch(frame["age"], frame["gender"], frame["dl"], frame["spt"],
+                       frame["hrp"], frame["sdc"], frame["plank"], frame["run"])
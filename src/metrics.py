@@ -0,0 +1,250 @@
+"""
+metrics.py
+
+Request instrumentation behind the /metrics page. Every request records
+its latency in a per-route histogram, how long it spent scoring, in the
+database and rendering templates, and how many SQL statements it ran.
+Phases never overlap: a query run while a template renders counts as
+database time, not rendering time.
+
+Database time comes from InstrumentedConnection, handed to sqlite3.connect
+as the connection factory. Scoring and rendering are marked with phase()
+or enter_phase()/exit_phase().
+
+A sampled fraction of requests runs under cProfile. If one of them turns
+out slow, its profile is logged. Slow requests are logged either way.
+"""
+
+# Imports
+import io
+import logging
+import random
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+
+# Globals
+logger = logging.getLogger(__name__)
+# Upper bounds in seconds of the latency histogram buckets
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+PHASES = ("scoring", "database", "rendering")
+# Functions shown in a logged profile, by cumulative time
+PROFILE_LINES = 25
+_local = threading.local()
+
+
+class RequestState:
+    """ Timings of the request running on this thread. """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.phases = dict.fromkeys(PHASES, 0.0)
+        self.queries = 0
+        self.active = None
+        self.since = self.start
+        self.stack = []
+        self.profiler = None
+
+
+class RouteStats:
+    """ Totals for one method and route. """
+
+    def __init__(self):
+        # One count per bucket plus the overflow bucket
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.count = 0
+        self.seconds = 0.0
+        self.phases = dict.fromkeys(PHASES, 0.0)
+        self.queries = 0
+
+
+class MetricsRegistry:
+    """ Thread-safe totals for every route, rendered in the Prometheus text format. """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.routes = {}
+        self.slow_requests = 0
+        self.profiles = 0
+
+    def observe(self, method, route, seconds, phases, queries):
+        """ Adds one finished request to its route's totals. """
+        bucket = len(LATENCY_BUCKETS)
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                bucket = i
+                break
+        with self.lock:
+            stats = self.routes.get((method, route))
+            if stats is None:
+                stats = self.routes[(method, route)] = RouteStats()
+            stats.buckets[bucket] += 1
+            stats.count += 1
+            stats.seconds += seconds
+            for name, value in phases.items():
+                stats.phases[name] += value
+            stats.queries += queries
+
+    def render(self, extra=()):
+        """ Returns every metric as Prometheus text. extra holds more (name, type, help, value) metrics to append. """
+        lines = ["# HELP acft_request_seconds Request latency by route.",
+                 "# TYPE acft_request_seconds histogram"]
+        with self.lock:
+            routes = sorted(self.routes.items())
+            for (method, route), stats in routes:
+                labels = f'method="{method}",route="{route}"'
+                cumulative = 0
+                for bound, count in zip(LATENCY_BUCKETS + ("+Inf",), stats.buckets):
+                    cumulative += count
+                    lines.append(f'acft_request_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+                lines.append(f"acft_request_seconds_sum{{{labels}}} {stats.seconds:.6f}")
+                lines.append(f"acft_request_seconds_count{{{labels}}} {stats.count}")
+
+            lines += ["# HELP acft_request_phase_seconds_total Time spent in each phase of a request. other is time outside every phase.",
+                      "# TYPE acft_request_phase_seconds_total counter"]
+            for (method, route), stats in routes:
+                labels = f'method="{method}",route="{route}"'
+                for name, value in stats.phases.items():
+                    lines.append(f'acft_request_phase_seconds_total{{{labels},phase="{name}"}} {value:.6f}')
+                other = max(stats.seconds - sum(stats.phases.values()), 0.0)
+                lines.append(f'acft_request_phase_seconds_total{{{labels},phase="other"}} {other:.6f}')
+
+            lines += ["# HELP acft_db_queries_total SQL statements run by requests.",
+                      "# TYPE acft_db_queries_total counter"]
+            for (method, route), stats in routes:
+                lines.append(f'acft_db_queries_total{{method="{method}",route="{route}"}} {stats.queries}')
+
+            lines += ["# HELP acft_slow_requests_total Requests slower than the slow request threshold.",
+                      "# TYPE acft_slow_requests_total counter",
+                      f"acft_slow_requests_total {self.slow_requests}",
+                      "# HELP acft_profiles_logged_total Profiles of sampled slow requests written to the log.",
+                      "# TYPE acft_profiles_logged_total counter",
+                      f"acft_profiles_logged_total {self.profiles}"]
+
+        for name, kind, help_text, value in extra:
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}", f"{name} {value}"]
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+
+def enter_phase(name):
+    """ Charges time to name until the matching exit_phase(). Does nothing outside a request. """
+    state = getattr(_local, "state", None)
+    if state is None:
+        return
+    now = time.perf_counter()
+    if state.active is not None:
+        state.phases[state.active] += now - state.since
+    state.stack.append(state.active)
+    state.active = name
+    state.since = now
+
+
+def exit_phase():
+    """ Goes back to the phase that was running before the last enter_phase(). """
+    state = getattr(_local, "state", None)
+    if state is None or not state.stack:
+        return
+    now = time.perf_counter()
+    state.phases[state.active] += now - state.since
+    state.active = state.stack.pop()
+    state.since = now
+
+
+@contextmanager
+def phase(name):
+    """ Charges the time inside the with block to a phase of the current request. """
+    enter_phase(name)
+    try:
+        yield
+    finally:
+        exit_phase()
+
+
+def begin_request(profile_rate=0.0):
+    """ Starts timing a request on this thread, profiling it with probability profile_rate. """
+    state = RequestState()
+    if profile_rate and random.random() < profile_rate:
+        # Only imported once profiling is switched on
+        import cProfile
+        state.profiler = cProfile.Profile()
+        try:
+            state.profiler.enable()
+        except ValueError:
+            # Another profiler is already running on this thread
+            state.profiler = None
+    _local.state = state
+
+
+def end_request(method, route, slow_seconds):
+    """ Stops timing the request on this thread, records it and logs it if it was slow. """
+    state = getattr(_local, "state", None)
+    if state is None:
+        return
+    _local.state = None
+    now = time.perf_counter()
+    if state.profiler is not None:
+        state.profiler.disable()
+    if state.active is not None:
+        state.phases[state.active] += now - state.since
+    seconds = now - state.start
+    REGISTRY.observe(method, route, seconds, state.phases, state.queries)
+
+    if seconds < slow_seconds:
+        return
+    with REGISTRY.lock:
+        REGISTRY.slow_requests += 1
+    logger.warning("Slow request %s %s took %.3fs (scoring %.3fs, database %.3fs, rendering %.3fs, %d queries)",
+                   method, route, seconds, state.phases["scoring"], state.phases["database"],
+                   state.phases["rendering"], state.queries)
+    if state.profiler is not None:
+        import pstats
+        stream = io.StringIO()
+        pstats.Stats(state.profiler, stream=stream).sort_stats("cumulative").print_stats(PROFILE_LINES)
+        with REGISTRY.lock:
+            REGISTRY.profiles += 1
+        logger.warning("Profile of slow request %s %s:\n%s", method, route, stream.getvalue())
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """ Cursor that charges statements and fetches to the database phase and counts statements. """
+
+    def execute(self, *args, **kwargs):
+        state = getattr(_local, "state", None)
+        if state is None:
+            return super().execute(*args, **kwargs)
+        state.queries += 1
+        with phase("database"):
+            return super().execute(*args, **kwargs)
+
+    def executemany(self, *args, **kwargs):
+        state = getattr(_local, "state", None)
+        if state is None:
+            return super().executemany(*args, **kwargs)
+        state.queries += 1
+        with phase("database"):
+            return super().executemany(*args, **kwargs)
+
+    def fetchone(self):
+        with phase("database"):
+            return super().fetchone()
+
+    def fetchmany(self, *args, **kwargs):
+        with phase("database"):
+            return super().fetchmany(*args, **kwargs)
+
+    def fetchall(self):
+        with phase("database"):
+            return super().fetchall()
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    """ Connection whose cursors are InstrumentedCursors. Pass as sqlite3.connect(factory=...). """
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
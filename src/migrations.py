@@ -0,0 +1,128 @@
+"""
+migrations.py
+
+Upgrades an existing SQLite database to the schema defined in server.py.
+The schema version lives in SQLite's user_version pragma and each migration
+moves the database up by one version inside its own transaction. A brand
+new database is created at the latest version by Pony, so no migrations run
+on it.
+"""
+
+# Imports
+import sqlite3
+
+
+def migration_1(conn):
+    """ Makes User.username unique and links each Acft to its User instead of a username string. """
+    conn.execute('ALTER TABLE "User" RENAME TO "User_v0"')
+    conn.execute('ALTER TABLE "Acft" RENAME TO "Acft_v0"')
+
+    conn.execute('''CREATE TABLE "User" (
+  "id" INTEGER PRIMARY KEY AUTOINCREMENT,
+  "username" TEXT UNIQUE NOT NULL,
+  "password" TEXT NOT NULL,
+  "name" TEXT NOT NULL,
+  "age" INTEGER NOT NULL,
+  "gender" TEXT NOT NULL
+)''')
+    # Keep the oldest account if a username was ever registered twice
+    conn.execute('''INSERT INTO "User" ("id", "username", "password", "name", "age", "gender")
+SELECT "id", "username", "password", "name", "age", "gender" FROM "User_v0"
+WHERE "id" IN (SELECT MIN("id") FROM "User_v0" GROUP BY "username")''')
+
+    conn.execute('''CREATE TABLE "Acft" (
+  "id" INTEGER PRIMARY KEY AUTOINCREMENT,
+  "date" TEXT NOT NULL,
+  "user" INTEGER NOT NULL REFERENCES "User" ("id") ON DELETE CASCADE,
+  "age" INTEGER NOT NULL,
+  "gender" TEXT NOT NULL,
+  "dl" INTEGER NOT NULL,
+  "spt" REAL NOT NULL,
+  "hrp" INTEGER NOT NULL,
+  "sdc_m" INTEGER NOT NULL,
+  "sdc_ss" INTEGER NOT NULL,
+  "plank_m" INTEGER NOT NULL,
+  "plank_ss" INTEGER NOT NULL,
+  "run_mm" INTEGER NOT NULL,
+  "run_ss" INTEGER NOT NULL,
+  "overall_score" INTEGER NOT NULL
+)''')
+    # ACFTs whose username has no account can't be linked and are dropped
+    conn.execute('''INSERT INTO "Acft" ("id", "date", "user", "age", "gender", "dl", "spt", "hrp",
+    "sdc_m", "sdc_ss", "plank_m", "plank_ss", "run_mm", "run_ss", "overall_score")
+SELECT a."id", a."date", u."id", a."age", a."gender", a."dl", a."spt", a."hrp",
+    a."sdc_m", a."sdc_ss", a."plank_m", a."plank_ss", a."run_mm", a."run_ss", a."overall_score"
+FROM "Acft_v0" a JOIN "User" u ON u."username" = a."username"''')
+    conn.execute('CREATE INDEX "idx_acft__user_date" ON "Acft" ("user", "date")')
+
+    conn.execute('DROP TABLE "Acft_v0"')
+    conn.execute('DROP TABLE "User_v0"')
+
+
+def migration_2(conn):
+    """ Adds per-event point columns to Acft. Existing rows stay NULL until backfilled. """
+    for column in ("dl_points", "spt_points", "hrp_points",
+                   "sdc_points", "plank_points", "run_points"):
+        conn.execute(f'ALTER TABLE "Acft" ADD COLUMN "{column}" INTEGER')
+
+
+def migration_3(conn):
+    """ Adds the unit a soldier belongs to. Pony creates the Unit and UnitRollup tables. """
+    conn.execute('ALTER TABLE "User" ADD COLUMN "unit" INTEGER REFERENCES "Unit" ("id") ON DELETE SET NULL')
+    conn.execute('CREATE INDEX "idx_user__unit" ON "User" ("unit")')
+
+
+def migration_4(conn):
+    """ Records which version of the scoring standards each Acft was scored against. Existing rows stay NULL until rescored. """
+    conn.execute('ALTER TABLE "Acft" ADD COLUMN "standards_version" TEXT')
+
+
+def migration_5(conn):
+    """ Adds the counter that keys each soldier's cached dashboard. """
+    conn.execute('ALTER TABLE "User" ADD COLUMN "scores_version" INTEGER NOT NULL DEFAULT 0')
+
+
+MIGRATIONS = [migration_1, migration_2, migration_3, migration_4, migration_5]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def has_table(filename, table):
+    """ Returns whether the database file has a table of that name. """
+    conn = sqlite3.connect(filename)
+    try:
+        return conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+                            (table,)).fetchone() is not None
+    finally:
+        conn.close()
+
+
+def migrate(filename, timeout=5.0):
+    """ Brings a database file up to SCHEMA_VERSION and into WAL mode. Returns the list of migration numbers applied. """
+    conn = sqlite3.connect(filename, isolation_level=None, timeout=timeout)
+    try:
+        # WAL lets readers carry on while another process writes. The mode is
+        # stored in the file, so setting it once covers every connection.
+        conn.execute("PRAGMA journal_mode = WAL")
+        tables = {row[0] for row in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table'")}
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+
+        # A new database gets the latest schema straight from Pony
+        if "User" not in tables:
+            conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            return []
+
+        applied = []
+        for number in range(version + 1, SCHEMA_VERSION + 1):
+            conn.execute("BEGIN")
+            try:
+                MIGRATIONS[number - 1](conn)
+                conn.execute(f"PRAGMA user_version = {number}")
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            applied.append(number)
+        return applied
+    finally:
+        conn.close()
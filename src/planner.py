@@ -0,0 +1,120 @@
+"""
+planner.py
+
+Plans the least effort way for a soldier to reach a goal ACFT total, such
+as 500 or 540, starting from their last test. No candidate result is ever
+scored: the inverted charts (Standards.targets) give the least demanding
+raw result for every points level, so each event offers one option per
+points level above where the soldier stands, and a small dynamic program
+over the points total picks one option per event.
+
+Effort is the improvement in raw units, divided by how far apart the 60
+and 100 point results are for the soldier's event, sex and age band, so
+seconds off the run can be weighed against pounds on the deadlift. Every
+event is planned to at least 60 points, the minimum to pass.
+"""
+
+# Imports
+import find_score
+import score_tables
+import unit_stats
+import validation
+
+
+# Globals
+MIN_EVENT_POINTS = unit_stats.PASSING_EVENT_POINTS
+MAX_TOTAL = len(score_tables.EVENTS) * score_tables.MAX_EVENT_POINTS
+# Points levels whose results set each event's scale of effort
+EFFORT_SCALE_POINTS = (MIN_EVENT_POINTS, score_tables.MAX_EVENT_POINTS)
+
+
+def improvement(event, current, target):
+    """ Returns how much better the target raw result is than the current one, or 0 if it is no better. """
+    if event in score_tables.LOWER_IS_BETTER:
+        return max(0.0, current - target)
+    return max(0.0, target - current)
+
+
+def event_options(event, column, current, points):
+    """ Returns the (points, raw result, effort) choices for one event from its inverted chart column: staying put if the current result passes, then every points level above it. """
+    low, high = (column.results[level] for level in EFFORT_SCALE_POINTS)
+    scale = abs(high - low) or 1.0
+
+    options = []
+    if points >= MIN_EVENT_POINTS:
+        options.append((points, current, 0.0))
+    for target in range(max(points + 1, MIN_EVENT_POINTS), score_tables.MAX_EVENT_POINTS + 1):
+        result = column.results[target]
+        # Levels the chart skips land on the same result as the one above them
+        if result is None or (options and column.points[target] == options[-1][0]):
+            continue
+        options.append((column.points[target], result, improvement(event, current, result) / scale))
+    return options
+
+
+def cheapest_choices(options, goal):
+    """ Picks one option per event so the points add up to at least goal with the least total effort. options holds each event's list of (points, raw result, effort). Returns the index picked for each event, or None if the goal is out of reach. """
+    unreachable = float("inf")
+    # Least effort found for each points total so far; totals past the goal count as the goal
+    efforts = [0.0] + [unreachable] * goal
+    steps = []
+    for choices in options:
+        next_efforts = [unreachable] * (goal + 1)
+        back = [None] * (goal + 1)
+        for total, effort in enumerate(efforts):
+            if effort == unreachable:
+                continue
+            for index, (points, result, cost) in enumerate(choices):
+                reached = min(goal, total + points)
+                if effort + cost < next_efforts[reached]:
+                    next_efforts[reached] = effort + cost
+                    back[reached] = (total, index)
+        efforts = next_efforts
+        steps.append(back)
+
+    if efforts[goal] == unreachable:
+        return None
+    picks = []
+    total = goal
+    for back in reversed(steps):
+        total, index = back[total]
+        picks.append(index)
+    picks.reverse()
+    return picks
+
+
+def format_result(event, result):
+    """ Formats a raw result for display: m:ss for timed events, meters for the throw, otherwise a count. """
+    if event in score_tables.RAW_SCALE:
+        return f"{result:.1f}"
+    if validation.EVENT_FIELDS[event] in validation.TIME_COLUMNS:
+        return "%d:%02d" % divmod(int(result), 60)
+    return str(int(result))
+
+
+def plan(standards, age, sex, last, goal):
+    """ Plans per-event targets for a goal total. last maps each result field (validation.EVENT_FIELDS) to the raw result of the soldier's last ACFT, times in seconds. Returns a dict of the current and planned totals and each event's current and target result, or None if the goal is out of reach. """
+    age_range = find_score.grab_age_range(age)
+    options = []
+    events = []
+    for event, name in validation.EVENT_FIELDS.items():
+        current = last[name]
+        points = find_score.score_event(event, age, sex, current, standards)
+        options.append(event_options(event, standards.targets[(event, sex, age_range)], current, points))
+        events.append({"event": event, "name": unit_stats.EVENT_NAMES[event],
+                       "current": format_result(event, current), "current_points": points})
+
+    picks = cheapest_choices(options, goal)
+    if picks is None:
+        return None
+    for planned, choices, index in zip(events, options, picks):
+        points, result, effort = choices[index]
+        planned["target"] = format_result(planned["event"], result)
+        planned["target_points"] = points
+        planned["raw_target"] = result if planned["event"] in score_tables.RAW_SCALE else int(result)
+        planned["change"] = points != planned["current_points"]
+
+    return {"goal": goal, "version": standards.version,
+            "current_total": sum(planned["current_points"] for planned in events),
+            "total": sum(planned["target_points"] for planned in events),
+            "events": events}
@@ -0,0 +1,65 @@
+"""
+score_cache.py
+
+Bounded least-recently-used memo for chart lookups. ACFT results cluster
+heavily (the same deadlift weights, round pushup counts and common run
+times), so most lookups repeat one seen shortly before. The cache counts
+hits, misses and evictions for the metrics page and is cleared whenever
+the charts are reloaded.
+"""
+
+# Imports
+import threading
+from collections import OrderedDict
+
+
+# Globals
+DEFAULT_MAX_SIZE = 4096
+
+
+class LRUCache:
+    """ Thread-safe LRU mapping with hit, miss and eviction counters. """
+
+    def __init__(self, max_size=DEFAULT_MAX_SIZE):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, compute):
+        """ Returns the cached value for key, calling compute() to fill it on a miss. """
+        with self.lock:
+            try:
+                value = self.entries[key]
+            except KeyError:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.entries.move_to_end(key)
+                return value
+
+        # Computed outside the lock; two threads missing together both compute
+        value = compute()
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+        return value
+
+    def clear(self):
+        """ Drops every entry. The counters keep running. """
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        """ Returns the counters, current size and hit rate as a dict. """
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {"hits": self.hits, "misses": self.misses,
+                    "evictions": self.evictions, "size": len(self.entries),
+                    "max_size": self.max_size,
+                    "hit_rate": self.hits / lookups if lookups else 0.0}
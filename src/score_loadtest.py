@@ -0,0 +1,116 @@
+"""
+score_loadtest.py
+
+Load test for score_service.py. Opens a number of keep-alive connections
+to a running instance and has each send /score requests back to back for
+a fixed time, then reports scores per second and request latency. Start
+the service first, then run from src/:
+python3 score_loadtest.py --connections 64 --batch 1 --duration 10
+"""
+
+# Imports
+import argparse
+import asyncio
+import json
+import random
+import time
+
+
+# Globals
+SEED = 12345
+
+
+def random_result(rng):
+    """ Returns one plausible ACFT result as a /score payload. """
+    return {"age": rng.randint(17, 65), "gender": rng.choice("MF"),
+            "dl": rng.randint(120, 340), "spt": round(rng.uniform(4, 13), 1),
+            "hrp": rng.randint(10, 60),
+            "sdc": f"{rng.randint(1, 3)}:{rng.randint(0, 59):02d}",
+            "plank": f"{rng.randint(1, 3)}:{rng.randint(0, 59):02d}",
+            "run": f"{rng.randint(13, 22)}:{rng.randint(0, 59):02d}"}
+
+
+def build_request(host, port, batch, rng):
+    """ Encodes one HTTP request carrying batch results. """
+    if batch == 1:
+        payload = random_result(rng)
+    else:
+        payload = {"results": [random_result(rng) for _ in range(batch)]}
+    body = json.dumps(payload).encode()
+    head = (f"POST /score HTTP/1.1\r\nHost: {host}:{port}\r\n"
+            "Content-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n\r\n")
+    return head.encode("latin-1") + body
+
+
+async def read_response(reader):
+    """ Reads one HTTP response. Returns (status, body). """
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        if name.strip().lower() == "content-length":
+            length = int(value)
+    return status, await reader.readexactly(length)
+
+
+async def run_connection(host, port, requests, deadline, latencies):
+    """ Sends requests back to back on one connection until the deadline. Returns the number of failures. """
+    reader, writer = await asyncio.open_connection(host, port)
+    failures = 0
+    i = 0
+    try:
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            writer.write(requests[i % len(requests)])
+            await writer.drain()
+            status, _ = await read_response(reader)
+            latencies.append(time.perf_counter() - started)
+            if status != 200:
+                failures += 1
+            i += 1
+    finally:
+        writer.close()
+    return failures
+
+
+async def load_test(host, port, connections, batch, duration):
+    """ Runs the load test. Returns (requests, failures, sorted latencies). """
+    rng = random.Random(SEED)
+    # Build a pool of requests up front so encoding stays out of the timing
+    requests = [build_request(host, port, batch, rng) for _ in range(256)]
+    latencies = []
+    deadline = time.perf_counter() + duration
+    failures = await asyncio.gather(*(
+        run_connection(host, port, requests, deadline, latencies)
+        for _ in range(connections)))
+    return len(latencies), sum(failures), sorted(latencies)
+
+
+def main():
+    """ Entrypoint of program. """
+    parser = argparse.ArgumentParser(description="Load test for the scoring service")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--connections", type=int, default=64)
+    parser.add_argument("--batch", type=int, default=1,
+                        help="results per request")
+    parser.add_argument("--duration", type=float, default=10.0)
+    args = parser.parse_args()
+
+    requests, failures, latencies = asyncio.run(load_test(
+        args.host, args.port, args.connections, args.batch, args.duration))
+    if not latencies:
+        print("No requests completed.")
+        return
+    print(f"{requests} requests, {failures} failed, "
+          f"{requests * args.batch / args.duration:.0f} scores/s")
+    print(f"latency p50 {latencies[len(latencies) // 2] * 1000:.1f} ms, "
+          f"p99 {latencies[int(len(latencies) * 0.99)] * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,252 @@
+"""
+score_service.py
+
+Standalone scoring API for other systems, such as unit training portals.
+It has no session or login. POST a JSON result, a list of results or
+{"results": [...]} to /score and get back the points for each event and
+the total, in the same shape:
+
+{"age": 25, "gender": "M", "dl": 200, "spt": 9.5, "hrp": 40,
+ "sdc": "1:55", "plank": "2:30", "run": "16:45"}
+-> {"DL": 71, "SPT": 78, "HRP": 84, "SDC": 78, "PLK": 80, "2MR": 83, "total": 474}
+
+Results are checked with the same schema as the dashboard and roster
+imports (validation.py). Times may be given as m:ss or as a number of
+seconds. Requests that arrive within a few milliseconds of each other are
+scored together with a single find_score.score_batch call, so many small
+requests cost about as much as one large one. If a batch fails, its
+requests are scored one by one, so only the one at fault gets a 500. The
+service runs on asyncio alone. Run it from src/ with:
+python3 score_service.py --port 8100
+"""
+
+# Imports
+import argparse
+import asyncio
+import json
+import logging
+import find_score
+import validation
+
+
+# Globals
+logger = logging.getLogger(__name__)
+# How long the first request of a batch waits for others to join it
+BATCH_WINDOW = 0.002
+# A batch this big is scored at once instead of waiting out the window
+MAX_BATCH = 4096
+MAX_RESULTS_PER_REQUEST = 10000
+MAX_BODY = 4 * 1024 * 1024
+RAW_FIELDS = tuple(field.name for field in validation.RESULT_FIELDS)
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found",
+           405: "Method Not Allowed", 413: "Payload Too Large", 500: "Internal Server Error"}
+
+
+class ScoreBatcher:
+    """ Collects results from concurrent requests and scores them together in micro-batches. """
+
+    def __init__(self, window=BATCH_WINDOW, max_batch=MAX_BATCH):
+        self.window = window
+        self.max_batch = max_batch
+        self.pending = []
+        self.flush_handle = None
+
+    def score(self, results):
+        """ Queues parsed results for the next batch. Returns a future of their scores. """
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append((results, future))
+        if sum(len(queued) for queued, _ in self.pending) >= self.max_batch:
+            self.flush()
+        elif self.flush_handle is None:
+            self.flush_handle = asyncio.get_running_loop().call_later(
+                self.window, self.flush)
+        return future
+
+    def flush(self):
+        """ Scores every queued result with one score_batch call and resolves their futures. """
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        pending, self.pending = self.pending, []
+        if not any(queued for queued, _ in pending):
+            return
+
+        try:
+            scores = score_results([result for queued, _ in pending for result in queued])
+        except Exception:
+            if len(pending) == 1:
+                resolve(*pending[0])
+                return
+            # Rescore each request on its own so only the one that broke the batch fails
+            logger.warning("Scoring a batch of %d requests failed; scoring them one by one.",
+                           len(pending))
+            for queued, future in pending:
+                resolve(queued, future)
+            return
+
+        start = 0
+        for queued, future in pending:
+            end = start + len(queued)
+            if not future.done():
+                future.set_result(scores[start:end])
+            start = end
+
+
+def score_results(results):
+    """ Scores parsed results with one score_batch call. Returns a dict of points for each result. """
+    scores = find_score.score_batch(
+        *([result[field] for result in results]
+          for field in ("age", "gender") + RAW_FIELDS))
+    columns = {key: points.tolist() for key, points in scores.items()}
+    return [{key: column[i] for key, column in columns.items()} for i in range(len(results))]
+
+
+def resolve(results, future):
+    """ Scores one request's results and settles its future with the scores or the error. """
+    try:
+        scores = score_results(results)
+    except Exception as error:
+        if not future.done():
+            future.set_exception(error)
+        return
+    if not future.done():
+        future.set_result(scores)
+
+
+def parse_result(payload):
+    """ Validates one JSON result and returns it as a dict ready for score_batch, times in seconds. """
+    if not isinstance(payload, dict):
+        raise validation.ValidationError("Each result must be an object.")
+    return validation.validate(payload, validation.SOLDIER_FIELDS + validation.RESULT_FIELDS)
+
+
+async def score_request(batcher, body):
+    """ Scores a /score request body. Returns (status, response document). """
+    try:
+        payload = json.loads(body)
+    except ValueError:
+        return 400, {"error": "Body must be JSON."}
+
+    single = isinstance(payload, dict) and "results" not in payload
+    if single:
+        items = [payload]
+    elif isinstance(payload, dict):
+        items = payload["results"]
+    else:
+        items = payload
+    if not isinstance(items, list):
+        return 400, {"error": "results must be a list."}
+    if len(items) > MAX_RESULTS_PER_REQUEST:
+        return 413, {"error": f"At most {MAX_RESULTS_PER_REQUEST} results per request."}
+
+    results = []
+    for i, item in enumerate(items):
+        try:
+            results.append(parse_result(item))
+        except validation.ValidationError as error:
+            if single:
+                return 400, {"error": str(error)}
+            return 400, {"error": f"Result {i}: {error}"}
+    if not results:
+        return 200, {"results": []}
+
+    scores = await batcher.score(results)
+    if single:
+        return 200, scores[0]
+    return 200, {"results": scores}
+
+
+async def read_request(reader):
+    """ Reads one HTTP/1.1 request. Returns (method, path, headers, body), or None at end of stream. """
+    request_line = await reader.readline()
+    if not request_line.strip():
+        return None
+    method, path, version = request_line.decode("latin-1").split()
+    headers = {"version": version}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+
+    length = int(headers.get("content-length", 0))
+    if length < 0 or length > MAX_BODY:
+        raise OverflowError
+    body = await reader.readexactly(length)
+    return method, path.split("?", 1)[0], headers, body
+
+
+def write_response(writer, status, document, keep_alive):
+    """ Writes a JSON response. """
+    body = json.dumps(document, separators=(",", ":")).encode()
+    head = (f"HTTP/1.1 {status} {REASONS[status]}\r\n"
+            "Content-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+    writer.write(head.encode("latin-1") + body)
+
+
+async def handle_connection(batcher, reader, writer):
+    """ Serves requests on one client connection until it closes. """
+    try:
+        while True:
+            try:
+                request = await read_request(reader)
+            except OverflowError:
+                write_response(writer, 413, {"error": "Request body too large."}, False)
+                break
+            except ValueError:
+                write_response(writer, 400, {"error": "Malformed request."}, False)
+                break
+            if request is None:
+                break
+
+            method, path, headers, body = request
+            keep_alive = (headers["version"] == "HTTP/1.1"
+                          and headers.get("connection", "").lower() != "close")
+            if path != "/score":
+                status, document = 404, {"error": "Not found."}
+            elif method != "POST":
+                status, document = 405, {"error": "Use POST."}
+            else:
+                try:
+                    status, document = await score_request(batcher, body)
+                except Exception:
+                    logger.exception("Scoring failed.")
+                    status, document = 500, {"error": "Scoring failed."}
+
+            write_response(writer, status, document, keep_alive)
+            await writer.drain()
+            if not keep_alive:
+                break
+    except (asyncio.IncompleteReadError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(host, port):
+    """ Runs the scoring service until cancelled. """
+    batcher = ScoreBatcher()
+    server = await asyncio.start_server(
+        lambda reader, writer: handle_connection(batcher, reader, writer), host, port)
+    print(f"Scoring service listening on http://{host}:{port}/score")
+    async with server:
+        await server.serve_forever()
+
+
+def main():
+    """ Entrypoint of program. """
+    parser = argparse.ArgumentParser(description="ACFT scoring service")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
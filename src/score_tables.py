@@ -0,0 +1,454 @@
+"""
+score_tables.py
+
+In-memory registry of the ACFT scoring charts. The charts are versioned:
+include/standards.json lists each version of the standards, the date it
+takes effect and the directory (under include/) holding its event/sex CSV
+charts. Every version is loaded once when this module is imported, so
+scoring a result never touches the disk.
+
+The CSVs are compiled into score_tables.bin in each version's directory:
+every chart column, plus the column expanded into a dense table indexed
+directly by raw score. The file is memory-mapped, so every server process
+shares the same pages, and startup only parses a CSV when the file is
+missing or older than the charts. Rebuild the files by hand with:
+python3 score_tables.py
+
+reload() loads the standards again after they change and swaps the new
+registry in with a single assignment. Code that scores a whole request
+should take one Standards object up front (current() or for_date()) and
+use it throughout, so a swap mid-request can't mix two versions.
+"""
+
+# Imports
+import csv
+import hashlib
+import json
+import logging
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+from datetime import date
+
+
+# Globals
+logger = logging.getLogger(__name__)
+INCLUDE_DIR = os.path.join(os.path.dirname(
+    os.path.abspath(__file__)), "..", "include")
+EVENTS = ("DL", "SPT", "HRP", "SDC", "PLK", "2MR")
+SEXES = ("M", "F")
+AGE_RANGES = ("17-21", "22-26", "27-31", "32-36", "37-41",
+              "42-46", "47-51", "52-56", "57-61", "62+")
+# Acft column (and import record key) holding the points for each event
+POINT_COLUMNS = {"DL": "dl_points", "SPT": "spt_points", "HRP": "hrp_points",
+                 "SDC": "sdc_points", "PLK": "plank_points", "2MR": "run_points"}
+# Events where a lower raw score (a faster time) earns more points.
+LOWER_IS_BETTER = ("SDC", "2MR")
+# Raw scores are keyed in whole units, except SPT which is charted in tenths.
+RAW_SCALE = {"SPT": 10}
+# Chart cell used when no raw score maps to that point value.
+MISSING_CELL = "---"
+STANDARDS_FILE = os.path.join(INCLUDE_DIR, "standards.json")
+DENSE_TABLE_NAME = "score_tables.bin"
+DENSE_MAGIC = b"ACFT"
+DENSE_FORMAT_VERSION = 2
+# magic, format version, sha1 of the CSV charts, number of tables
+DENSE_HEADER = struct.Struct("<4sH20sH")
+# event, sex, age range, lowest raw key, highest raw key, data offset
+DENSE_ENTRY = struct.Struct("<4s1s6siiIIH")
+
+# One age band of a chart. points/thresholds are in chart order (highest
+# points first); rows that were "---" in the CSV are left out, so every
+# threshold is a real number. sorted_thresholds/sorted_points hold the same
+# rows ordered by ascending threshold for binary search.
+ChartColumn = namedtuple("ChartColumn", [
+    "points", "thresholds", "sorted_points", "sorted_thresholds"])
+# Most points one event can score
+MAX_EVENT_POINTS = 100
+# The inverse of one age band of a chart, indexed by points. results[p] is
+# the least demanding raw result that scores at least p points (None if no
+# result does) and points[p] what it actually scores, which is more than p
+# where the chart skips that row.
+TargetColumn = namedtuple("TargetColumn", ["results", "points"])
+
+
+def chart_path(event, sex, include_dir=INCLUDE_DIR):
+    """ Returns the path of the CSV chart for an event and sex. """
+    return os.path.join(include_dir, f"{event}_{sex}.csv")
+
+
+def load_chart(csv_path, lower_is_better=False):
+    """ Parses one CSV chart into a dict of age range -> ChartColumn. """
+    with open(csv_path, "r", newline="") as file:
+        rows = list(csv.reader(file))
+
+    header = rows[0]
+    columns = {}
+    for col in range(1, len(header)):
+        points = array("B")
+        thresholds = array("d")
+        for row in rows[1:]:
+            if row[col] == MISSING_CELL:
+                continue
+            points.append(int(row[0]))
+            thresholds.append(float(row[col]))
+        if lower_is_better:
+            sorted_points = points
+            sorted_thresholds = thresholds
+        else:
+            sorted_points = array("B", reversed(points))
+            sorted_thresholds = array("d", reversed(thresholds))
+        columns[header[col]] = ChartColumn(
+            points, thresholds, sorted_points, sorted_thresholds)
+
+    return columns
+
+
+def load_charts(include_dir=INCLUDE_DIR):
+    """ Loads every event/sex chart into a dict keyed by (event, sex). """
+    charts = {}
+    for event in EVENTS:
+        for sex in SEXES:
+            charts[(event, sex)] = load_chart(
+                chart_path(event, sex, include_dir), event in LOWER_IS_BETTER)
+    return charts
+
+
+def compile_chart_json(charts):
+    """
+    Renders every chart as compact JSON for clients, shaped
+    {event: {sex: {age range: [[points, threshold], ...]}}} in chart order.
+    """
+    document = {}
+    for (event, sex), columns in charts.items():
+        document.setdefault(event, {})[sex] = {
+            age_range: [[points, threshold] for points, threshold
+                        in zip(column.points, column.thresholds)]
+            for age_range, column in columns.items()}
+    return json.dumps(document, separators=(",", ":")).encode()
+
+
+def invert_column(column):
+    """ Builds the TargetColumn of a ChartColumn. """
+    results = [None] * (MAX_EVENT_POINTS + 1)
+    points = [None] * (MAX_EVENT_POINTS + 1)
+    result = earned = None
+    # Chart order runs from the most points down, each threshold easier than the one before
+    row = 0
+    for target in range(MAX_EVENT_POINTS, -1, -1):
+        while row < len(column.points) and column.points[row] >= target:
+            # A threshold charted on several rows scores the highest of them
+            if column.thresholds[row] != result:
+                result, earned = column.thresholds[row], column.points[row]
+            row += 1
+        results[target] = result
+        points[target] = earned
+    return TargetColumn(tuple(results), tuple(points))
+
+
+def build_target_index(charts):
+    """ Inverts every chart column into a dict of (event, sex, age range) -> TargetColumn. """
+    return {(event, sex, age_range): invert_column(column)
+            for (event, sex), columns in charts.items()
+            for age_range, column in columns.items()}
+
+
+def raw_key(event, raw_score):
+    """ Converts a raw score into the integer key used by the dense tables. """
+    scaled = round(raw_score * RAW_SCALE.get(event, 1), 6)
+    # Round toward the worse result, the same as reading the chart by hand
+    if event in LOWER_IS_BETTER:
+        return math.ceil(scaled)
+    return math.floor(scaled)
+
+
+def expand_column(event, column):
+    """ Expands a ChartColumn into (lowest key, highest key, points bytes). """
+    scale = RAW_SCALE.get(event, 1)
+    keys = [round(threshold * scale) for threshold in column.sorted_thresholds]
+    points = column.sorted_points
+
+    table = bytearray()
+    for key in range(keys[0], keys[-1] + 1):
+        if event in LOWER_IS_BETTER:
+            location = bisect_left(keys, key)
+        else:
+            location = bisect_right(keys, key) - 1
+        table.append(points[location])
+
+    return keys[0], keys[-1], bytes(table)
+
+
+def charts_digest(include_dir=INCLUDE_DIR):
+    """ Returns a sha1 digest of every CSV chart, used to spot a stale dense file. """
+    digest = hashlib.sha1()
+    for event in EVENTS:
+        for sex in SEXES:
+            with open(chart_path(event, sex, include_dir), "rb") as file:
+                digest.update(file.read())
+    return digest.digest()
+
+
+def build_dense_tables(charts, digest):
+    """ Serializes every chart column and its dense table into the dense table file format. """
+    entries = []
+    data = bytearray()
+    for event in EVENTS:
+        for sex in SEXES:
+            for age_range in AGE_RANGES:
+                column = charts[(event, sex)][age_range]
+                low, high, table = expand_column(event, column)
+                table_offset = len(data)
+                data.extend(table)
+                # The column itself, in chart order: points bytes then little-endian thresholds
+                rows = len(column.points)
+                chart_offset = len(data)
+                data.extend(column.points.tobytes())
+                data.extend(struct.pack(f"<{rows}d", *column.thresholds))
+                entries.append(DENSE_ENTRY.pack(event.encode(), sex.encode(),
+                                                age_range.encode(), low, high,
+                                                table_offset, chart_offset, rows))
+
+    header = DENSE_HEADER.pack(DENSE_MAGIC, DENSE_FORMAT_VERSION,
+                               digest, len(entries))
+    return header + b"".join(entries) + bytes(data)
+
+
+def write_dense_file(path, charts, digest):
+    """ Writes the dense table file, replacing any old one atomically. """
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, "wb") as file:
+        file.write(build_dense_tables(charts, digest))
+    os.replace(temp_path, path)
+
+
+class DenseTables:
+    """ Raw score -> points lookup over a dense table buffer, which also holds the chart columns. """
+
+    def __init__(self, buffer, digest=None):
+        magic, version, file_digest, count = DENSE_HEADER.unpack_from(buffer)
+        if magic != DENSE_MAGIC or version != DENSE_FORMAT_VERSION:
+            raise ValueError("Not a dense score table file.")
+        if digest is not None and digest != file_digest:
+            raise ValueError("Dense score table file is out of date.")
+
+        self.buffer = buffer
+        self.index = {}
+        self.columns = {}
+        data_start = DENSE_HEADER.size + count * DENSE_ENTRY.size
+        for i in range(count):
+            event, sex, age_range, low, high, offset, chart_offset, rows = DENSE_ENTRY.unpack_from(
+                buffer, DENSE_HEADER.size + i * DENSE_ENTRY.size)
+            key = (event.rstrip(b"\0").decode(), sex.decode(),
+                   age_range.rstrip(b"\0").decode())
+            self.index[key] = (low, high, data_start + offset)
+            self.columns[key] = (data_start + chart_offset, rows)
+
+    def chart_column(self, event, sex, age_range):
+        """ Decodes one ChartColumn from the buffer. """
+        start, rows = self.columns[(event, sex, age_range)]
+        points = array("B", self.buffer[start:start + rows])
+        thresholds = array("d", struct.unpack_from(f"<{rows}d", self.buffer, start + rows))
+        if event in LOWER_IS_BETTER:
+            return ChartColumn(points, thresholds, points, thresholds)
+        return ChartColumn(points, thresholds, array("B", reversed(points)),
+                           array("d", reversed(thresholds)))
+
+    def charts(self):
+        """ Decodes every chart column into a dict keyed by (event, sex), like load_charts. """
+        charts = {}
+        for event, sex, age_range in self.columns:
+            charts.setdefault((event, sex), {})[age_range] = self.chart_column(event, sex, age_range)
+        return charts
+
+    def points(self, event, sex, age_range, raw_score):
+        """ Returns the points for a raw score with a single index. """
+        low, high, start = self.index[(event, sex, age_range)]
+        key = raw_key(event, raw_score)
+        if key < low:
+            key = low
+        elif key > high:
+            key = high
+        return self.buffer[start + key - low]
+
+
+def load_dense_tables(path, include_dir, digest):
+    """ Memory-maps the dense table file, rebuilding it from the CSV charts in include_dir if missing or stale. """
+    charts = None
+    for attempt in range(2):
+        try:
+            with open(path, "rb") as file:
+                return DenseTables(mmap.mmap(file.fileno(), 0,
+                                             access=mmap.ACCESS_READ), digest)
+        except (OSError, ValueError, struct.error):
+            if attempt:
+                break
+        charts = load_charts(include_dir)
+        try:
+            write_dense_file(path, charts, digest)
+        except OSError:
+            break
+
+    # The include/ directory is read-only or the file is unreadable: keep the
+    # tables in this process only.
+    return DenseTables(build_dense_tables(charts, digest), digest)
+
+
+class Standards:
+    """ One version of the scoring charts and the date it takes effect. """
+
+    def __init__(self, version, effective, directory):
+        self.version = version
+        self.effective = effective
+        self.directory = directory
+        self.digest = charts_digest(directory)
+        self.dense_tables = load_dense_tables(
+            os.path.join(directory, DENSE_TABLE_NAME), directory, self.digest)
+        self._charts = None
+        self._targets = None
+
+    @property
+    def charts(self):
+        """ Every chart column keyed by (event, sex), decoded from the compiled file on first use. """
+        if self._charts is None:
+            self._charts = self.dense_tables.charts()
+        return self._charts
+
+    @property
+    def targets(self):
+        """ Every chart column inverted, keyed by (event, sex, age range), built on first use. See TargetColumn. """
+        if self._targets is None:
+            self._targets = build_target_index(self.charts)
+        return self._targets
+
+    def get_column(self, event, sex, age_range):
+        """ Returns the ChartColumn for an event, sex and age range. """
+        return self.charts[(event, sex)][age_range]
+
+
+class StandardsRegistry:
+    """ Every version of the standards, ordered by effective date. A reload builds a new registry instead of changing this one. """
+
+    def __init__(self, versions, signature=None):
+        self.versions = sorted(versions, key=lambda standards: standards.effective)
+        self.by_version = {standards.version: standards for standards in self.versions}
+        self.effective_dates = [standards.effective for standards in self.versions]
+        self.signature = signature
+
+    def for_date(self, datestr):
+        """ Returns the standards in effect on a YYYY-MM-DD date. Dates before the first version use the first. """
+        location = bisect_right(self.effective_dates, datestr) - 1
+        return self.versions[max(location, 0)]
+
+    def current(self):
+        """ Returns the standards in effect today. """
+        return self.for_date(str(date.today()))
+
+
+def read_manifest(path=STANDARDS_FILE):
+    """ Reads and checks the standards manifest. Returns a list of (version, effective date, directory). """
+    with open(path, "r") as file:
+        manifest = json.load(file)
+
+    entries = []
+    for entry in manifest["versions"]:
+        version = str(entry["version"])
+        effective = str(date.fromisoformat(entry["effective"]))
+        directory = os.path.normpath(os.path.join(
+            os.path.dirname(path), entry.get("directory", version)))
+        entries.append((version, effective, directory))
+
+    if not entries:
+        raise ValueError("The standards manifest lists no versions.")
+    if len({version for version, _, _ in entries}) != len(entries):
+        raise ValueError("The standards manifest repeats a version.")
+    if len({effective for _, effective, _ in entries}) != len(entries):
+        raise ValueError("Two versions of the standards share an effective date.")
+    return entries
+
+
+def standards_signature(path=STANDARDS_FILE):
+    """ Returns the size and modification time of the manifest and every chart it lists, to spot changes cheaply. """
+    files = [path]
+    for _, _, directory in read_manifest(path):
+        files.extend(chart_path(event, sex, directory)
+                     for event in EVENTS for sex in SEXES)
+    signature = []
+    for filename in files:
+        stat = os.stat(filename)
+        signature.append((filename, stat.st_size, stat.st_mtime_ns))
+    return tuple(signature)
+
+
+def load_registry(path=STANDARDS_FILE):
+    """ Loads every version listed in the standards manifest. """
+    signature = standards_signature(path)
+    return StandardsRegistry([Standards(version, effective, directory)
+                              for version, effective, directory in read_manifest(path)],
+                             signature)
+
+
+REGISTRY = load_registry()
+RELOAD_LOCK = threading.Lock()
+
+
+def current():
+    """ Returns the standards in effect today. """
+    return REGISTRY.current()
+
+
+def for_date(datestr):
+    """ Returns the standards in effect on a YYYY-MM-DD date. """
+    return REGISTRY.for_date(datestr)
+
+
+def get_column(event, sex, age_range):
+    """ Returns the ChartColumn for an event, sex and age range under the current standards. """
+    return current().get_column(event, sex, age_range)
+
+
+def reload(path=STANDARDS_FILE):
+    """ Loads the standards again if their files changed and swaps them in. Returns True if the registry was replaced. """
+    global REGISTRY
+    with RELOAD_LOCK:
+        if standards_signature(path) == REGISTRY.signature:
+            return False
+        # Requests already running keep the registry they started with
+        REGISTRY = load_registry(path)
+    return True
+
+
+def watch(interval, on_reload=None):
+    """ Starts a daemon thread that checks for changed standards every interval seconds. on_reload(registry) runs after each swap. """
+    def run():
+        while True:
+            time.sleep(interval)
+            try:
+                if reload() and on_reload is not None:
+                    on_reload(REGISTRY)
+            except (OSError, ValueError, KeyError, IndexError, struct.error) as error:
+                # A half-written or broken chart set: keep serving the old one
+                logger.warning("Could not reload scoring standards: %r", error)
+
+    thread = threading.Thread(target=run, name="standards-watcher", daemon=True)
+    thread.start()
+    return thread
+
+
+def main():
+    """ Entrypoint of program. Rebuilds the dense table file of every version. """
+    for version, _, directory in read_manifest():
+        path = os.path.join(directory, DENSE_TABLE_NAME)
+        charts = load_charts(directory)
+        write_dense_file(path, charts, charts_digest(directory))
+        print(f"Wrote {path} for standards {version}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""
+serve_benchmark.py
+
+Measures how request throughput scales with the number of server workers.
+For each worker count it starts gunicorn on wsgi:app against a scratch
+database, then a pool of client processes each sign up a soldier, log in
+and, until time runs out, load their dashboard four times for every ACFT
+they record. Run from src/ with gunicorn installed:
+python3 serve_benchmark.py --workers 1 2 4 8
+"""
+
+# Imports
+import argparse
+import http.cookiejar
+import os
+import secrets
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from multiprocessing import Pool
+
+
+# Globals
+HOST = "127.0.0.1"
+PORT = 8765
+STARTUP_TIMEOUT = 30
+# Dashboard loads per recorded ACFT
+READS_PER_WRITE = 4
+ACFT_FORM = {"deadlift": "200", "spt": "9.5", "hrp": "40", "sdc_m": "1",
+             "sdc_ss": "55", "plank_m": "2", "plank_ss": "30",
+             "run_mm": "16", "run_ss": "45"}
+
+
+def wait_for_port(host, port, timeout):
+    """ Blocks until something accepts connections on host:port. """
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection((host, port), timeout=1):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"Server did not start on {host}:{port}.")
+
+
+def run_client(args):
+    """ Plays one soldier for duration seconds. Returns (requests served, failures). """
+    base_url, client_id, duration = args
+    opener = urllib.request.build_opener(
+        urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+    # Each soldier comes through the trusted proxy from an address of their own
+    opener.addheaders.append(("X-Forwarded-For", f"10.0.{client_id // 256}.{client_id % 256}"))
+    username = f"bench{client_id}"
+
+    def post(path, form):
+        data = urllib.parse.urlencode(form).encode()
+        with opener.open(base_url + path, data) as response:
+            response.read()
+
+    try:
+        post("/signup", {"username": username, "name": "Bench", "age": "25",
+                         "gender": "M", "password": "bench"})
+        post("/login", {"username": username, "password": "bench"})
+    except (urllib.error.URLError, OSError):
+        # A soldier who can't log in never gets to load a dashboard
+        return 0, 1
+
+    served = 0
+    failures = 0
+    deadline = time.monotonic() + duration
+    while time.monotonic() < deadline:
+        try:
+            if served % (READS_PER_WRITE + 1) == READS_PER_WRITE:
+                post("/dashboard", ACFT_FORM)
+            else:
+                with opener.open(base_url + "/dashboard") as response:
+                    response.read()
+            served += 1
+        except (urllib.error.URLError, OSError):
+            failures += 1
+    return served, failures
+
+
+def measure(workers, clients, duration):
+    """ Runs one benchmark round against a fresh server. Returns (requests per second, failures). """
+    with tempfile.TemporaryDirectory() as scratch:
+        # The clients connect from 127.0.0.1 but stand in for soldiers behind one reverse proxy
+        env = dict(os.environ, ACFT_DB=os.path.join(scratch, "bench.db"), ACFT_TRUSTED_PROXIES="1",
+                   ACFT_SECRET_KEY=secrets.token_hex(32))
+        server = subprocess.Popen(
+            [sys.executable, "-m", "gunicorn", "--workers", str(workers),
+             "--bind", f"{HOST}:{PORT}", "wsgi:app"],
+            env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            wait_for_port(HOST, PORT, STARTUP_TIMEOUT)
+            base_url = f"http://{HOST}:{PORT}"
+            with Pool(clients) as pool:
+                results = pool.map(run_client, [(base_url, i, duration)
+                                                for i in range(clients)])
+        finally:
+            server.terminate()
+            server.wait()
+
+    served = sum(result[0] for result in results)
+    failures = sum(result[1] for result in results)
+    return served / duration, failures
+
+
+def main():
+    """ Entrypoint of program. """
+    parser = argparse.ArgumentParser(description="Server throughput benchmark")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4],
+                        help="worker counts to measure")
+    parser.add_argument("--clients", type=int, default=16,
+                        help="concurrent client processes")
+    parser.add_argument("--duration", type=float, default=10.0,
+                        help="seconds to measure each worker count")
+    args = parser.parse_args()
+
+    print(f"{os.cpu_count()} CPUs, {args.clients} clients, {args.duration:g}s per round")
+    print("workers  requests/s  failures")
+    for workers in args.workers:
+        rate, failures = measure(workers, args.clients, args.duration)
+        print(f"{workers:>7}  {rate:>10.1f}  {failures:>8}")
+
+
+if __name__ == "__main__":
+    main()
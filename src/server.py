@@ -13,37 +13,115 @@ Authors:
 """
 
 # Imports
-from cProfile import run
-from curses.ascii import isalnum
-from multiprocessing.sharedctypes import Value
-from flask import Flask, render_template, redirect, url_for, request, flash
+from flask import Flask, render_template, redirect, url_for, request, session, flash, jsonify, abort, send_file, before_render_template, template_rendered
 from flask_login import LoginManager, login_user, login_required, logout_user, current_user, UserMixin
+from markupsafe import Markup
 from pony import orm
-import brainfuck as pandas
-from io import StringIO
+from werkzeug.middleware.proxy_fix import ProxyFix
+import argparse
+import auth
+import bulk_import
+import downsample
+import export
 import find_score
-import sys
+import gzip
+import hashlib
+import json
+import logging
+import metrics
+import migrations
+import planner
+import score_cache
+import score_tables
+import unit_stats
+import user_stats
+import validation
 import os
+import tempfile
+import threading
 from datetime import date
+try:
+    import fcntl
+except ImportError:
+    # Windows has no fcntl, and the pre-fork servers that need the lock don't run there
+    fcntl = None
 
 
 # Globals
 app = Flask("ACFT Calculator App", static_url_path="/static")
 # Needed for flash messages
 app.config['SECRET_KEY'] = 'abcde'
-DB_FILENAME = "test.db"
-INCLUDE_DIR = "../include/"
-db = orm.Database("sqlite", filename=DB_FILENAME, create_db=True)
+# Most points the score-over-time chart is sent; longer series are downsampled
+app.config['CHART_MAX_POINTS'] = 200
+# Requests slower than this many seconds are logged
+app.config['SLOW_REQUEST_SECONDS'] = 0.5
+# Fraction of requests run under cProfile; the profile is logged if the request is slow
+app.config['PROFILE_SAMPLE_RATE'] = float(os.environ.get("ACFT_PROFILE_SAMPLE_RATE", 0))
+# Reverse proxies in front of the app whose X-Forwarded-* headers are trusted; 0 trusts none
+TRUSTED_PROXIES = int(os.environ.get("ACFT_TRUSTED_PROXIES", "0"))
+if TRUSTED_PROXIES:
+    # request.remote_addr becomes the client's address instead of the proxy's
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXIES, x_proto=TRUSTED_PROXIES,
+                            x_host=TRUSTED_PROXIES)
+# Build the chart payload and load numpy in create_app instead of on the first request that needs them
+app.config['WARM_START'] = os.environ.get("ACFT_WARM_START", "0") == "1"
+# Seconds browsers and proxies may reuse the welcome page before checking for a new one
+app.config['STATIC_PAGE_MAX_AGE'] = 24 * 60 * 60
+logger = logging.getLogger(__name__)
+DB_FILENAME = os.environ.get("ACFT_DB", "test.db")
+# Seconds a connection waits on another process's write lock before giving up
+DB_BUSY_TIMEOUT = 30
+HISTORY_PAGE_SIZE = 25
+# Total planned for by /api/plan when no goal is given
+PLAN_DEFAULT_GOAL = 540
+# Months of rollups shown on a unit's leader dashboard
+UNIT_PERIODS = 12
+# Seconds between checks for new or changed scoring standards
+STANDARDS_RELOAD_INTERVAL = 10
+# Pony resolves a relative database filename against this file's directory
+DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), DB_FILENAME)
+# Held across processes while one of them migrates and maps the database
+DB_LOCK_PATH = DB_PATH + ".lock"
+MAPPING_LOCK = threading.Lock()
+# Both throttles count in each process's memory, so with N workers a client may get up to N times these limits
+# Logins and signups one client address may attempt per minute; 0 turns the limit off
+LOGIN_ADDRESS_LIMIT = int(os.environ.get("ACFT_LOGIN_ADDRESS_LIMIT", "30"))
+ADDRESS_THROTTLE = auth.LoginThrottle(limit=LOGIN_ADDRESS_LIMIT or None, period=60)
+# Failed logins one account may have from one client address in five minutes.
+# Keyed on both, so bad passwords from elsewhere can't lock the soldier out.
+ACCOUNT_THROTTLE = auth.LoginThrottle(limit=5, period=300)
+# Seconds a logged in user is served from memory. Another worker's profile changes show up after this.
+USER_CACHE_SECONDS = 30
+USER_CACHE = auth.UserCache(USER_CACHE_SECONDS)
+# Rendered dashboard fragments and chart series, keyed on the soldier's scores_version
+DASHBOARD_CACHE_SIZE = 2000
+DASHBOARD_CACHE = score_cache.LRUCache(DASHBOARD_CACHE_SIZE)
+db = orm.Database("sqlite", filename=DB_FILENAME, create_db=True,
+                  timeout=DB_BUSY_TIMEOUT, factory=metrics.InstrumentedConnection)
+
+
+@db.on_connect(provider="sqlite")
+def sqlite_pragmas(database, connection):
+    """ Per-connection SQLite settings. The database itself is put in WAL mode by migrations.migrate. """
+    cursor = connection.cursor()
+    # Safe in WAL mode: a crash can lose the last commits but never corrupts the file
+    cursor.execute("PRAGMA synchronous = NORMAL")
 
 
 class User(UserMixin, db.Entity):
     """ User Table, can have many ACFT instances. """
     id = orm.PrimaryKey(int, auto=True)
-    username = orm.Required(str)
+    username = orm.Required(str, unique=True)
     password = orm.Required(str)
     name = orm.Required(str)
     age = orm.Required(int)
     gender = orm.Required(str)
+    acfts = orm.Set("Acft")
+    unit = orm.Optional("Unit", reverse="members")
+    # Bumped whenever the soldier's ACFTs, stats or led units change; keys their cached dashboard
+    scores_version = orm.Required(int, default=0, sql_default="0", volatile=True)
+    led_units = orm.Set("Unit", reverse="leader")
+    stats = orm.Optional("UserStats")
 
     def __str__(self):
         return f"{self.username}, {self.password}, {self.name}, {self.age}, {self.gender}"
@@ -53,7 +131,7 @@ class Acft(db.Entity):
     """ ACFT Table, must be connected to a User instance. """
 
     date = orm.Required(str)
-    username = orm.Required(str)
+    user = orm.Required(User)
     age = orm.Required(int)
     gender = orm.Required(str)
     dl = orm.Required(int)
@@ -66,27 +144,117 @@ class Acft(db.Entity):
     run_mm = orm.Required(int)
     run_ss = orm.Required(int)
     overall_score = orm.Required(int)
+    # Per-event points, None on rows saved before they were kept until backfilled
+    dl_points = orm.Optional(int)
+    spt_points = orm.Optional(int)
+    hrp_points = orm.Optional(int)
+    sdc_points = orm.Optional(int)
+    plank_points = orm.Optional(int)
+    run_points = orm.Optional(int)
+    # Version of the scoring standards the points were computed with, None until rescored
+    standards_version = orm.Optional(str, nullable=True)
+    orm.composite_index(user, date)
 
     def __str__(self):
-        return f"{self.date} {self.username} {self.age} {self.gender} {self.dl} {self.spt} {self.hrp} {self.sdc_m} {self.sdc_ss} {self.plank_m} {self.plank_ss} {self.run_mm}  {self.run_ss} {self.overall_score}"
+        return f"{self.date} {self.user.username} {self.age} {self.gender} {self.dl} {self.spt} {self.hrp} {self.sdc_m} {self.sdc_ss} {self.plank_m} {self.plank_ss} {self.run_mm}  {self.run_ss} {self.overall_score}"
+
+
+class Unit(db.Entity):
+    """ Unit Table, can be nested under a parent unit and have a leader. """
+    id = orm.PrimaryKey(int, auto=True)
+    name = orm.Required(str, unique=True)
+    parent = orm.Optional("Unit", reverse="subunits")
+    subunits = orm.Set("Unit", reverse="parent")
+    leader = orm.Optional(User, reverse="led_units")
+    members = orm.Set(User, reverse="unit")
+    rollups = orm.Set("UnitRollup")
+
+    def __str__(self):
+        return self.name
+
+
+class UnitRollup(db.Entity):
+    """ Monthly totals of every ACFT taken in a unit and its subunits. See unit_stats.py. """
+    unit = orm.Required(Unit)
+    period = orm.Required(str)
+    tests = orm.Required(int)
+    score_sum = orm.Required(int)
+    passed = orm.Required(int)
+    dl_sum = orm.Required(int)
+    spt_sum = orm.Required(int)
+    hrp_sum = orm.Required(int)
+    sdc_sum = orm.Required(int)
+    plank_sum = orm.Required(int)
+    run_sum = orm.Required(int)
+    dl_weakest = orm.Required(int)
+    spt_weakest = orm.Required(int)
+    hrp_weakest = orm.Required(int)
+    sdc_weakest = orm.Required(int)
+    plank_weakest = orm.Required(int)
+    run_weakest = orm.Required(int)
+    orm.PrimaryKey(unit, period)
+
+
+class UserStats(db.Entity):
+    """ Personal records, latest ACFTs and running trend sums of one soldier. See user_stats.py. """
+    user = orm.PrimaryKey(User)
+    tests = orm.Required(int)
+    x_sum = orm.Required(int, size=64)
+    xx_sum = orm.Required(int, size=64)
+    score_best = orm.Required(int)
+    dl_best = orm.Required(int)
+    spt_best = orm.Required(int)
+    hrp_best = orm.Required(int)
+    sdc_best = orm.Required(int)
+    plank_best = orm.Required(int)
+    run_best = orm.Required(int)
+    score_sum = orm.Required(int, size=64)
+    dl_sum = orm.Required(int, size=64)
+    spt_sum = orm.Required(int, size=64)
+    hrp_sum = orm.Required(int, size=64)
+    sdc_sum = orm.Required(int, size=64)
+    plank_sum = orm.Required(int, size=64)
+    run_sum = orm.Required(int, size=64)
+    score_xy_sum = orm.Required(int, size=64)
+    dl_xy_sum = orm.Required(int, size=64)
+    spt_xy_sum = orm.Required(int, size=64)
+    hrp_xy_sum = orm.Required(int, size=64)
+    sdc_xy_sum = orm.Required(int, size=64)
+    plank_xy_sum = orm.Required(int, size=64)
+    run_xy_sum = orm.Required(int, size=64)
+    # The latest user_stats.RECENT_TESTS ACFTs as [date, score, event points...]
+    recent = orm.Required(orm.Json)
 
 
-@orm.db_session
 def authenticate(username, password):
-    """ Authenticates a user by username and password. """
-    possible_user = orm.select(u for u in User if u.username == username)
-    if not possible_user:
-        return False
-    else:
-        return possible_user.first().password == password
+    """ Returns the User with this username and password, or None. """
+    # A legacy plaintext password that matches is replaced by a hash
+    with orm.db_session:
+        possible_user = User.get(username=username)
+    # Unknown usernames are checked against a dummy hash so they take as long as known ones
+    stored = possible_user.password if possible_user else auth.dummy_hash()
+    if not auth.verify_password(stored, password) or possible_user is None:
+        return None
+    if auth.needs_rehash(stored):
+        set_password(possible_user.id, auth.hash_password(password))
+    return possible_user
 
 
 @orm.db_session
-def add_score_record(date, username, age, gender, dl, spt, hrp, sdc_m, sdc_ss, plank_m, plank_ss, run_mm, run_ss, overall_score):
-    """ Adds an ACFT score record to the database. """
+def set_password(user_id, password_hash):
+    """ Stores a new password hash for a user. """
+    User[user_id].password = password_hash
+    USER_CACHE.invalidate(user_id)
+
+
+@orm.db_session
+def add_score_record(date, username, age, gender, dl, spt, hrp, sdc_m, sdc_ss, plank_m, plank_ss, run_mm, run_ss, overall_score,
+                     dl_points, spt_points, hrp_points, sdc_points, plank_points, run_points, standards_version=None):
+    """ Adds an ACFT score record to the database, to the soldier's stats and to its unit's rollups. """
+    user = User.get(username=username)
     score = Acft(
         date=date,
-        username=username,
+        user=user,
         age=age,
         gender=gender,
         dl=dl,
@@ -98,87 +266,653 @@ def add_score_record(date, username, age, gender, dl, spt, hrp, sdc_m, sdc_ss, p
         plank_ss=plank_ss,
         run_mm=run_mm,
         run_ss=run_ss,
-        overall_score=overall_score
+        overall_score=overall_score,
+        dl_points=dl_points,
+        spt_points=spt_points,
+        hrp_points=hrp_points,
+        sdc_points=sdc_points,
+        plank_points=plank_points,
+        run_points=run_points,
+        standards_version=standards_version
     )
+    # Writing first takes SQLite's write lock, so no other request can update the stats in between
+    orm.flush()
+
+    points = [dl_points, spt_points, hrp_points, sdc_points, plank_points, run_points]
+    stats = load_user_stats([user.id])
+    user_stats.add_acft(stats[user.id], date, overall_score, points)
+    save_user_stats(stats)
+    bump_scores_versions([user.id])
+
+    if user.unit is not None:
+        deltas = {}
+        unit_stats.add_acft(deltas, unit_stats.unit_chain(user.unit.id, unit_parents()), date, points)
+        apply_rollups(deltas)
+
+
+# Acft columns written by import_roster, one value per record key.
+ACFT_COLUMNS = ("date", "user", "age", "gender", "dl", "spt", "hrp", "sdc_m",
+                "sdc_ss", "plank_m", "plank_ss", "run_mm", "run_ss", "overall_score",
+                "dl_points", "spt_points", "hrp_points", "sdc_points", "plank_points", "run_points",
+                "standards_version")
+BACKFILL_BATCH_SIZE = 5000
+# Soldiers looked up per UserStats query, under SQLite's limit on bound parameters
+STATS_QUERY_SIZE = 500
+# Sorts after every YYYY-MM-DD date, closing the newest standards' date range
+LAST_DATE = "9999-99-99"
+EXPORT_MIMETYPES = {"parquet": "application/vnd.apache.parquet",
+                    "arrow": "application/vnd.apache.arrow.file"}
+
+
+def bulk_insert(entity, columns, rows):
+    """ Inserts many rows into an entity's table with one executemany. """
+    # Runs in the caller's db_session
+    sql = 'INSERT INTO "%s" (%s) VALUES (%s)' % (
+        entity._table_,
+        ", ".join(f'"{column}"' for column in columns),
+        ", ".join("?" for column in columns))
+    db.get_connection().executemany(sql, rows)
+
+
+def unit_parents():
+    """ Maps every unit id to its parent unit id. Must be called inside a db_session. """
+    return dict(db.select('SELECT "id", "parent" FROM "Unit"'))
+
+
+def apply_rollups(deltas):
+    """ Adds pending unit_stats deltas to UnitRollup, one upsert per (unit, period). """
+    if not deltas:
+        return
+    columns = unit_stats.ROLLUP_COLUMNS
+    sql = 'INSERT INTO "UnitRollup" ("unit", "period", %s) VALUES (?, ?, %s) ON CONFLICT ("unit", "period") DO UPDATE SET %s' % (
+        ", ".join(f'"{column}"' for column in columns),
+        ", ".join("?" for column in columns),
+        ", ".join(f'"{column}" = "{column}" + excluded."{column}"' for column in columns))
+    db.get_connection().executemany(
+        sql, [(unit_id, period, *counters) for (unit_id, period), counters in deltas.items()])
+
+
+def load_user_stats(user_ids):
+    """ Returns user id -> user_stats dict for each id, empty for soldiers with no stats. """
+    user_ids = list(user_ids)
+    stats = {user_id: user_stats.empty() for user_id in user_ids}
+    columns = ", ".join(f'"{column}"' for column in user_stats.STATS_COLUMNS)
+    for start in range(0, len(user_ids), STATS_QUERY_SIZE):
+        chunk = user_ids[start:start + STATS_QUERY_SIZE]
+        rows = db.get_connection().execute(
+            'SELECT "user", %s, "recent" FROM "UserStats" WHERE "user" IN (%s)' % (
+                columns, ", ".join("?" for user_id in chunk)), chunk)
+        for row in rows:
+            counters = dict(zip(user_stats.STATS_COLUMNS, row[1:-1]))
+            counters["recent"] = json.loads(row[-1])
+            stats[row[0]] = counters
+    return stats
+
+
+def save_user_stats(stats):
+    """ Writes user id -> user_stats dict back to UserStats. Must be called inside a db_session. """
+    if not stats:
+        return
+    columns = user_stats.STATS_COLUMNS
+    sql = 'INSERT OR REPLACE INTO "UserStats" ("user", %s, "recent") VALUES (?, %s, ?)' % (
+        ", ".join(f'"{column}"' for column in columns),
+        ", ".join("?" for column in columns))
+    db.get_connection().executemany(sql, [
+        (user_id, *(counters[column] for column in columns), json.dumps(counters["recent"]))
+        for user_id, counters in stats.items()])
+
+
+def bump_scores_versions(user_ids=None):
+    """ Moves the scores_version of the given soldiers, or of everyone, on. """
+    # Their cached dashboards are rebuilt on the next view. Runs in the caller's db_session.
+    if user_ids is None:
+        db.execute('UPDATE "User" SET "scores_version" = "scores_version" + 1')
+        return
+    db.get_connection().executemany(
+        'UPDATE "User" SET "scores_version" = "scores_version" + 1 WHERE "id" = ?',
+        [(user_id,) for user_id in user_ids])
+
+
+def commanded_unit_ids(user_id, parents):
+    """ Returns the ids of every unit the user leads, directly or through a parent. """
+    led = set(db.select('SELECT "id" FROM "Unit" WHERE "leader" = $user_id'))
+    return {unit_id for unit_id in parents
+            if led.intersection(unit_stats.unit_chain(unit_id, parents))}
+
+
+def unit_subtree(unit_id, parents):
+    """ Returns the ids of a unit and every unit below it. """
+    return {other for other in parents if unit_id in unit_stats.unit_chain(other, parents)}
+
+
+@orm.db_session
+def named_unit_ids(unit_name):
+    """ Returns the ids of the named unit and every unit below it, or None. """
+    unit = Unit.get(name=unit_name)
+    if unit is None:
+        return None
+    return unit_subtree(unit.id, unit_parents())
+
+
+@orm.db_session
+def rebuild_rollups():
+    """ Recomputes every UnitRollup and returns the number of ACFTs counted. """
+    db.execute('DELETE FROM "UnitRollup"')
+    parents = unit_parents()
+    deltas = {}
+    counted = 0
+
+    rows = db.execute("""SELECT a."date", u."unit", a."dl_points", a."spt_points", a."hrp_points",
+        a."sdc_points", a."plank_points", a."run_points"
+        FROM "Acft" a JOIN "User" u ON u."id" = a."user"
+        WHERE u."unit" IS NOT NULL AND a."dl_points" IS NOT NULL""")
+    for row in rows:
+        unit_stats.add_acft(deltas, unit_stats.unit_chain(row[1], parents), row[0], list(row[2:]))
+        counted += 1
+
+    apply_rollups(deltas)
+    return counted
+
+
+@orm.db_session
+def rebuild_user_stats():
+    """ Recomputes every soldier's UserStats and returns the number of ACFTs counted. """
+    db.execute('DELETE FROM "UserStats"')
+    stats = {}
+    counted = 0
+
+    rows = db.execute("""SELECT "user", "date", "overall_score", "dl_points", "spt_points", "hrp_points",
+        "sdc_points", "plank_points", "run_points"
+        FROM "Acft" WHERE "dl_points" IS NOT NULL ORDER BY "user", "date", "id" ASC""")
+    for row in rows:
+        counters = stats.get(row[0])
+        if counters is None:
+            # Rows come grouped by user, so finished soldiers are written out in batches
+            if len(stats) >= BACKFILL_BATCH_SIZE:
+                save_user_stats(stats)
+                stats = {}
+            counters = stats[row[0]] = user_stats.empty()
+        user_stats.add_acft(counters, row[1], row[2], row[3:])
+        counted += 1
+
+    save_user_stats(stats)
+    bump_scores_versions()
+    return counted
 
 
 @orm.db_session
+def import_roster(lines, importer=None):
+    """ Scores and adds a roster's valid rows, returning the count and rejected (line, error) rows. """
+    # An importer (a username) may only add their own rows and those of soldiers in units they lead.
+    # An unreadable file raises bulk_import.RosterError and rolls the whole import back.
+    imported = 0
+    rejected = []
+    parents = unit_parents()
+    deltas = {}
+    stats = {}
+
+    commanded = None
+    if importer is not None:
+        importer = User.get(username=importer)
+        commanded = commanded_unit_ids(importer.id, parents)
+
+    for records, batch_rejected in bulk_import.read_batches(lines):
+        rejected.extend(batch_rejected)
+
+        # One query per batch to match rows to their users
+        usernames = list({record["username"] for line, record in records})
+        users = {}
+        if usernames:
+            users = {u.username: u for u in orm.select(
+                u for u in User if u.username in usernames)}
+
+        valid = []
+        for line, record in records:
+            user = users.get(record["username"])
+            if user is None:
+                rejected.append((line, "Unknown username."))
+                continue
+            if commanded is not None and user != importer and (
+                    user.unit is None or user.unit.id not in commanded):
+                rejected.append((line, "Soldier is not in a unit you lead."))
+                continue
+            if record["age"] is None:
+                record["age"] = user.age
+            if record["gender"] is None:
+                record["gender"] = user.gender
+            record["user"] = user.id
+            valid.append(record)
+
+        with metrics.phase("scoring"):
+            bulk_import.score_records(valid)
+        bulk_insert(Acft, ACFT_COLUMNS, [
+            tuple(record[column] for column in ACFT_COLUMNS) for record in valid])
+        imported += len(valid)
+
+        stats.update(load_user_stats({record["user"] for record in valid} - stats.keys()))
+        for record in valid:
+            user_stats.add_acft(stats[record["user"]], record["date"], record["overall_score"],
+                                [record[key] for key in score_tables.POINT_COLUMNS.values()])
+            unit = users[record["username"]].unit
+            if unit is not None:
+                unit_stats.add_acft(deltas, unit_stats.unit_chain(unit.id, parents), record["date"],
+                                    [record[key] for key in score_tables.POINT_COLUMNS.values()])
+
+    apply_rollups(deltas)
+    save_user_stats(stats)
+    bump_scores_versions(stats)
+
+    rejected.sort()
+    return imported, rejected
+
+
+@orm.db_session
+def backfill_batch(batch_size):
+    """ Scores one batch of ACFTs saved without per-event points and returns how many were updated. """
+    rows = db.select("""SELECT a."id", a."age", a."gender", a."dl", a."spt", a."hrp", a."sdc_m", a."sdc_ss",
+        a."plank_m", a."plank_ss", a."run_mm", a."run_ss", a."date", u."unit"
+        FROM "Acft" a JOIN "User" u ON u."id" = a."user"
+        WHERE a."dl_points" IS NULL LIMIT $batch_size""")
+    if not rows:
+        return 0
+
+    scores = find_score.score_batch(
+        [row[1] for row in rows], [row[2] for row in rows],
+        [row[3] for row in rows], [row[4] for row in rows], [row[5] for row in rows],
+        [row[6] * 60 + row[7] for row in rows],
+        [row[8] * 60 + row[9] for row in rows],
+        [row[10] * 60 + row[11] for row in rows])
+
+    events = list(score_tables.POINT_COLUMNS)
+    sql = 'UPDATE "Acft" SET %s WHERE "id" = ?' % ", ".join(
+        f'"{score_tables.POINT_COLUMNS[event]}" = ?' for event in events)
+    points = zip(*(scores[event].tolist() for event in events))
+    points = list(points)
+    db.get_connection().executemany(
+        sql, [(*row_points, row[0]) for row_points, row in zip(points, rows)])
+
+    # Rows only count toward unit rollups once they have points
+    parents = unit_parents()
+    deltas = {}
+    for row_points, row in zip(points, rows):
+        if row[13] is not None:
+            unit_stats.add_acft(deltas, unit_stats.unit_chain(row[13], parents), row[12], list(row_points))
+    apply_rollups(deltas)
+
+    return len(rows)
+
+
+def backfill_event_points(batch_size=BACKFILL_BATCH_SIZE):
+    """ Rescores the ACFTs saved without per-event points and returns how many were updated. """
+    updated = 0
+    while True:
+        count = backfill_batch(batch_size)
+        if not count:
+            break
+        updated += count
+    if updated:
+        rebuild_user_stats()
+    return updated
+
+
+@orm.db_session
+def rescore_batch(standards, start, end, after_id, batch_size):
+    """ Rescores one batch of ACFTs dated in [start, end), returning the count and last id seen. """
+    version = standards.version
+    rows = db.select("""SELECT a."id", a."age", a."gender", a."dl", a."spt", a."hrp", a."sdc_m", a."sdc_ss",
+        a."plank_m", a."plank_ss", a."run_mm", a."run_ss", a."date", u."unit",
+        a."dl_points", a."spt_points", a."hrp_points", a."sdc_points", a."plank_points", a."run_points"
+        FROM "Acft" a JOIN "User" u ON u."id" = a."user"
+        WHERE a."id" > $after_id AND a."date" >= $start AND a."date" < $end
+        AND a."standards_version" IS NOT $version
+        ORDER BY a."id" LIMIT $batch_size""")
+    if not rows:
+        return 0, after_id
+
+    scores = find_score.score_batch(
+        [row[1] for row in rows], [row[2] for row in rows],
+        [row[3] for row in rows], [row[4] for row in rows], [row[5] for row in rows],
+        [row[6] * 60 + row[7] for row in rows],
+        [row[8] * 60 + row[9] for row in rows],
+        [row[10] * 60 + row[11] for row in rows],
+        standards)
+
+    events = list(score_tables.POINT_COLUMNS)
+    sql = 'UPDATE "Acft" SET %s, "overall_score" = ?, "standards_version" = ? WHERE "id" = ?' % ", ".join(
+        f'"{score_tables.POINT_COLUMNS[event]}" = ?' for event in events)
+    points = list(zip(*(scores[event].tolist() for event in events)))
+    totals = scores["total"].tolist()
+    db.get_connection().executemany(
+        sql, [(*row_points, total, version, row[0])
+              for row_points, total, row in zip(points, totals, rows)])
+
+    # Swap each row's old points for the new ones in its unit's rollups
+    parents = unit_parents()
+    deltas = {}
+    for row_points, row in zip(points, rows):
+        if row[13] is None:
+            continue
+        chain = unit_stats.unit_chain(row[13], parents)
+        if row[14] is not None:
+            unit_stats.add_acft(deltas, chain, row[12], list(row[14:20]), sign=-1)
+        unit_stats.add_acft(deltas, chain, row[12], list(row_points))
+    apply_rollups(deltas)
+
+    return len(rows), rows[-1][0]
+
+
+def rescore_standards(batch_size=BACKFILL_BATCH_SIZE):
+    """ Rescores ACFTs against the standards in effect on their dates and returns how many changed. """
+    registry = score_tables.REGISTRY
+    starts = [""] + registry.effective_dates[1:]
+    ends = registry.effective_dates[1:] + [LAST_DATE]
+    rescored = 0
+    for standards, start, end in zip(registry.versions, starts, ends):
+        after_id = 0
+        while True:
+            count, after_id = rescore_batch(standards, start, end, after_id, batch_size)
+            if not count:
+                break
+            rescored += count
+    # A rescore can lower a personal record, which running stats can't take back out
+    if rescored:
+        rebuild_user_stats()
+    return rescored
+
+
+@orm.db_session
+def export_acfts(sink, fmt="parquet", start=None, end=None, unit_ids=None, chunk_size=export.EXPORT_CHUNK_SIZE):
+    """ Writes the ACFTs from start to end to sink as a columnar export and returns the row count. """
+    # Dates are YYYY-MM-DD and inclusive. unit_ids limits it to soldiers now in those units.
+    conditions = ['a."date" >= ?', 'a."date" <= ?']
+    params = [start or "", end or LAST_DATE]
+    if unit_ids is not None:
+        unit_ids = sorted(unit_ids)
+        conditions.append('u."unit" IN (%s)' % ", ".join("?" for unit_id in unit_ids))
+        params.extend(unit_ids)
+
+    cursor = db.get_connection().execute("""SELECT a."id", a."date", a."user", u."username", u."unit",
+        a."age", a."gender", a."dl", a."spt", a."hrp",
+        a."sdc_m" * 60 + a."sdc_ss", a."plank_m" * 60 + a."plank_ss", a."run_mm" * 60 + a."run_ss",
+        a."overall_score", a."dl_points", a."spt_points", a."hrp_points",
+        a."sdc_points", a."plank_points", a."run_points", a."standards_version"
+        FROM "Acft" a JOIN "User" u ON u."id" = a."user"
+        WHERE %s ORDER BY a."id" ASC""" % " AND ".join(conditions), params)
+    return export.write_export(iter(lambda: cursor.fetchmany(chunk_size), []), sink, fmt)
+
+
 def add_user(username, name, password, age, gender):
-    """ Adds a user to the database with no ACFTs. """
-    u = User(
-        username=username,
-        name=name,
-        password=password,
-        age=age,
-        gender=gender,
-    )
+    """ Adds a user to the database with no ACFTs. The password is hashed before it is stored. """
+    password_hash = auth.hash_password(password)
+    with orm.db_session:
+        u = User(
+            username=username,
+            name=name,
+            password=password_hash,
+            age=age,
+            gender=gender,
+        )
+
+
+@orm.db_session
+def add_unit(name, parent=None, leader=None):
+    """ Adds a unit with an optional parent and leader, returning a status message. """
+    if Unit.exists(name=name):
+        return f"Unit {name} already exists."
+    parent_unit = Unit.get(name=parent) if parent else None
+    if parent and parent_unit is None:
+        return f"Unknown parent unit {parent}."
+    leader_user = User.get(username=leader) if leader else None
+    if leader and leader_user is None:
+        return f"Unknown leader {leader}."
+    Unit(name=name, parent=parent_unit, leader=leader_user)
+    if leader_user is not None:
+        bump_scores_versions([leader_user.id])
+    return f"Added unit {name}."
+
+
+@orm.db_session
+def assign_unit(username, unit_name):
+    """ Moves a soldier into a unit, returning a status message. """
+    # Their earlier ACFTs join the new unit's rollups on the next rebuild
+    user = User.get(username=username)
+    unit = Unit.get(name=unit_name)
+    if user is None or unit is None:
+        return "Unknown username or unit."
+    user.unit = unit
+    USER_CACHE.invalidate(user.id)
+    return f"Assigned {username} to {unit_name}."
 
 
 @orm.db_session
 def username_exists(username):
     """ Returns True if username already exists, False otherwise. """
-    query = orm.select(u for u in User if u.username == username)
-    return True if query else False
+    return User.exists(username=username)
+
+
+# Fragments and pages that render the same for everyone, kept per process: template name -> Markup
+STATIC_FRAGMENTS = {}
+
+
+def static_fragment(template, **context):
+    """ Returns a page that renders the same for everyone, rendering it on first use. """
+    fragment = STATIC_FRAGMENTS.get(template)
+    if fragment is None:
+        fragment = STATIC_FRAGMENTS[template] = Markup(render_template(template, **context))
+    return fragment
+
+
+def static_page(template, max_age):
+    """ Serves a static_fragment page with an ETag, cacheable for max_age seconds. """
+    # With max_age 0, clients revalidate every time and get a 304 if the page is unchanged
+    body = static_fragment(template)
+    etag = hashlib.sha1(body.encode()).hexdigest()
+
+    if request.if_none_match.contains_weak(etag):
+        response = app.response_class(status=304)
+    else:
+        response = app.response_class(body, mimetype="text/html")
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = f"public, max-age={max_age}" if max_age else "no-cache"
+    return response
 
 
 @app.route("/")
 def base():
     """ Renders the base page."""
-    return render_template('welcome.html')
+    return static_page('welcome.html', app.config['STATIC_PAGE_MAX_AGE'])
+
+
+def compile_chart_payload(standards):
+    """ Compiles the /csv chart JSON, a gzipped copy and an ETag for a version of the standards. """
+    body = score_tables.compile_chart_json(standards.charts)
+    return {"body": body,
+            "gzip": gzip.compress(body, compresslevel=9, mtime=0),
+            "etag": standards.digest.hex()}
+
+
+# /csv responses served from memory, keyed by chart digest
+CHART_PAYLOADS = {}
+
+
+def chart_payload(standards):
+    """ Returns the compiled /csv response for a version of the standards, compiling it on first use. """
+    payload = CHART_PAYLOADS.get(standards.digest)
+    if payload is None:
+        payload = compile_chart_payload(standards)
+        CHART_PAYLOADS[standards.digest] = payload
+    return payload
 
 
 @app.route("/csv")
 def csv():
-    """ Loads .csv values for score calculation. """
-    csvs = []
-    for filename in os.listdir(INCLUDE_DIR):
-        f = os.path.join(INCLUDE_DIR, filename)
-        if os.path.isfile(f) and " " in f:
-            csvs.append(f)
-    for csv_path in csvs:
-        with open(csv_path, "r") as file:
-            data = file.read()
-        temp_out = StringIO()
-        sys.stdout = temp_out
-        interpreter = pandas.NiceInterpreter()
-        interpreter.interpret(data)
-        sys.stdout = sys.__stdout__
-        return temp_out.getvalue()
+    """ Serves the scoring charts as JSON, gzipped when accepted, with an ETag for 304s. """
+    payload = chart_payload(score_tables.current())
+    gzipped = "gzip" in request.accept_encodings
+    # Each encoding is a different representation, so it gets its own tag
+    etag = payload["etag"] + ("-gzip" if gzipped else "")
+
+    if request.if_none_match.contains_weak(etag):
+        response = app.response_class(status=304)
+    else:
+        response = app.response_class(payload["gzip"] if gzipped else payload["body"],
+                                      mimetype="application/json")
+        if gzipped:
+            response.headers["Content-Encoding"] = "gzip"
+    response.set_etag(etag)
+    response.headers["Vary"] = "Accept-Encoding"
+    # Clients revalidate on every use, which costs a 304 and no body
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+
+@app.before_request
+def start_request_timing():
+    """ Starts the per-request timings behind /metrics. """
+    metrics.begin_request(app.config['PROFILE_SAMPLE_RATE'])
+
+
+@app.teardown_request
+def finish_request_timing(error):
+    """ Records the request's latency, phase times and query count. """
+    route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+    metrics.end_request(request.method, route, app.config['SLOW_REQUEST_SECONDS'])
+
+
+@before_render_template.connect_via(app)
+def start_rendering(sender, template, context, **extra):
+    """ Charges template rendering to the rendering phase. """
+    metrics.enter_phase("rendering")
+
+
+@template_rendered.connect_via(app)
+def finish_rendering(sender, template, context, **extra):
+    """ Ends the rendering phase started by start_rendering. """
+    metrics.exit_phase()
+
+
+@app.route("/metrics")
+def metrics_page():
+    """ Serves request timings, query counts and cache statistics as Prometheus text. """
+    cache = find_score.SCORE_CACHE.stats()
+    dashboards = DASHBOARD_CACHE.stats()
+    extra = [("acft_score_cache_hits_total", "counter", "score_event lookups answered from the cache.", cache["hits"]),
+             ("acft_score_cache_misses_total", "counter", "score_event lookups that missed the cache.", cache["misses"]),
+             ("acft_score_cache_evictions_total", "counter", "Entries evicted from the score cache.", cache["evictions"]),
+             ("acft_score_cache_entries", "gauge", "Entries in the score cache.", cache["size"]),
+             ("acft_score_cache_hit_ratio", "gauge", "Share of score_event lookups answered from the cache.",
+              f"{cache['hit_rate']:.4f}"),
+             ("acft_dashboard_cache_hits_total", "counter", "Dashboard fragments and chart series served from the cache.", dashboards["hits"]),
+             ("acft_dashboard_cache_misses_total", "counter", "Dashboard fragments and chart series rendered.", dashboards["misses"]),
+             ("acft_dashboard_cache_entries", "gauge", "Entries in the dashboard cache.", dashboards["size"])]
+    return app.response_class(metrics.REGISTRY.render(extra), mimetype="text/plain; version=0.0.4")
+
+
+def score_row(item, username):
+    """ Formats one ACFT as the list of values shown in the history table. """
+    itemlist = []
+    itemlist.append(item.date)
+    itemlist.append(username)
+    itemlist.append(item.age)
+    itemlist.append(item.gender)
+    itemlist.append(item.dl)
+    itemlist.append(item.spt)
+    itemlist.append(item.hrp)
+    if 1 == len(str(item.sdc_ss)):
+        itemlist.append(str(item.sdc_m) + ":" + "0"+str(item.sdc_ss))
+    else:
+        itemlist.append(str(item.sdc_m) + ":" + str(item.sdc_ss))
+    if 1 == len(str(item.plank_ss)):
+        itemlist.append(str(item.plank_m) + ":" + "0"+str(item.plank_ss))
+    else:
+        itemlist.append(str(item.plank_m) + ":" + str(item.plank_ss))
+    if 1 == len(str(item.run_ss)):
+        itemlist.append(str(item.run_mm) + ":" + "0"+str(item.run_ss))
+    else:
+        itemlist.append(str(item.run_mm) + ":" + str(item.run_ss))
+    itemlist.append(item.overall_score)
+
+    return itemlist
 
 
 @orm.db_session
 def get_user_scores(username):
     """ Get a list of scores by the given user. """
+    user = User.get(username=username)
     scores = orm.select(
-        score for score in Acft if score.username == username)[:]
-
-    scorelist = []
-    for item in scores:
-        itemlist = []
-        itemlist.append(item.date)
-        itemlist.append(item.username)
-        itemlist.append(item.age)
-        itemlist.append(item.gender)
-        itemlist.append(item.dl)
-        itemlist.append(item.spt)
-        itemlist.append(item.hrp)
-        if 1 == len(str(item.sdc_ss)):
-            itemlist.append(str(item.sdc_m) + ":" + "0"+str(item.sdc_ss))
-        else:
-            itemlist.append(str(item.sdc_m) + ":" + str(item.sdc_ss))
-        if 1 == len(str(item.plank_ss)):
-            itemlist.append(str(item.plank_m) + ":" + "0"+str(item.plank_ss))
-        else:
-            itemlist.append(str(item.plank_m) + ":" + str(item.plank_ss))
-        if 1 == len(str(item.run_ss)):
-            itemlist.append(str(item.run_mm) + ":" + "0"+str(item.run_ss))
-        else:
-            itemlist.append(str(item.run_mm) + ":" + str(item.run_ss))
-        itemlist.append(item.overall_score)
+        score for score in Acft if score.user == user).order_by(
+        lambda score: (score.date, score.id))[:]
+
+    return [score_row(item, username) for item in scores]
 
-        scorelist.append(itemlist)
 
-    return scorelist
+@orm.db_session
+def get_user_scores_page(username, before=None, page_size=HISTORY_PAGE_SIZE):
+    """ Get one page of the user's scores, newest first, and the cursor of the next page. """
+    # before is the (date, id) cursor of the last row shown; the last page's next cursor is None
+    user = User.get(username=username)
+    query = orm.select(score for score in Acft if score.user == user)
+    if before is not None:
+        before_date, before_id = before
+        query = query.filter(lambda score: score.date < before_date or (
+            score.date == before_date and score.id < before_id))
+    scores = query.order_by(
+        lambda score: (orm.desc(score.date), orm.desc(score.id)))[:page_size + 1]
+
+    next_cursor = None
+    if len(scores) > page_size:
+        scores = scores[:page_size]
+        next_cursor = (scores[-1].date, scores[-1].id)
+
+    return [score_row(item, username) for item in scores], next_cursor
+
+
+@orm.db_session
+def get_user_score_series(username, start, end):
+    """ Get (date, id, overall score) rows for the user's ACFTs between two dates, oldest first. """
+    user = User.get(username=username)
+    return orm.select((score.date, score.id, score.overall_score) for score in Acft
+                      if score.user == user and score.date >= start and score.date <= end
+                      ).order_by(1, 2)[:]
+
+
+@orm.db_session
+def get_last_result(user_id):
+    """ Get the user's latest raw results by result field, times in seconds, or None. """
+    rows = db.select("""SELECT "dl", "spt", "hrp", "sdc_m" * 60 + "sdc_ss", "plank_m" * 60 + "plank_ss",
+        "run_mm" * 60 + "run_ss" FROM "Acft" WHERE "user" = $user_id
+        ORDER BY "date" DESC, "id" DESC LIMIT 1""")
+    if not rows:
+        return None
+    return dict(zip(validation.EVENT_FIELDS.values(), rows[0]))
+
+
+@orm.db_session
+def get_led_units(user_id):
+    """ Get (id, name) pairs of the units the user leads directly. """
+    return orm.select((unit.id, unit.name) for unit in Unit
+                      if unit.leader.id == user_id).order_by(2)[:]
+
+
+@orm.db_session
+def get_scores_version(user_id):
+    """ Get the counter that moves on whenever the user's ACFTs, stats or led units change. """
+    return db.select('SELECT "scores_version" FROM "User" WHERE "id" = $user_id')[0]
+
+
+@orm.db_session
+def get_user_progress(user_id):
+    """ Get the user's records, recent averages and trends, or None before their first ACFT. """
+    return user_stats.summarize(load_user_stats([user_id])[user_id])
+
+
+def parse_cursor(text):
+    """ Parses a "date,id" history page cursor. Returns None if missing or malformed. """
+    before_date, _, before_id = (text or "").partition(",")
+    try:
+        return str(date.fromisoformat(before_date)), int(before_id)
+    except ValueError:
+        return None
 
 
 def get_user_overall_scores(querylist):
@@ -214,137 +948,207 @@ def dashboard():
         datestr = str(date.today())
 
         try:
-            dl = int(request.form["deadlift"])
-            if (dl < 0):
-                raise ValueError
-
-        except ValueError:
-            print("Invalid deadlift score.")
-            flash('Invalid deadlift score.')
+            result = validation.validate(validation.from_form(request.form), validation.RESULT_FIELDS)
+        except validation.ValidationError as error:
+            logger.debug("Rejected ACFT from %s: %s", username, error)
+            flash(str(error))
             return redirect(url_for("dashboard"))
 
-        try:
-            spt = float(request.form["spt"])
-            if (spt < 0):
-                raise ValueError
-
-        except ValueError:
-            print("Invalid standing power throw.")
-            flash('Invalid standing power throw.')
-            return redirect(url_for("dashboard"))
-
-        try:
-            hrp = int(request.form["hrp"])
-            if (hrp < 0):
-                raise ValueError
-
-        except ValueError:
-            print("Invalid hand release pushup score.")
-            flash('Invalid hand release pushup score.')
-            return redirect(url_for("dashboard"))
+        # One version for all six events, even if the standards are swapped meanwhile
+        standards = score_tables.for_date(datestr)
+        with metrics.phase("scoring"):
+            scores = [find_score.score_event(event, age, gender, result[name], standards)
+                      for event, name in validation.EVENT_FIELDS.items()]
 
-        try:
-            sdc_m = int(request.form["sdc_m"])
-            if (sdc_m < 0 or sdc_m > 59):
-                raise ValueError
+        overall_score = sum(scores)
 
-        except ValueError:
-            print("Invalid sprint drag carry minutes.")
-            flash('Invalid sprint drag carry minutes.')
-            return redirect(url_for("dashboard"))
+        logger.debug("Saving ACFT %s %s %s %s %s %s", datestr, username, age, gender, result, overall_score)
 
-        try:
-            sdc_ss = int(request.form["sdc_ss"])
-            if (sdc_ss < 0 or sdc_ss > 59):
-                raise ValueError
+        columns = validation.time_columns(result)
+        add_score_record(datestr, username, age, gender, result["dl"], result["spt"], result["hrp"],
+                         columns["sdc_m"], columns["sdc_ss"], columns["plank_m"], columns["plank_ss"],
+                         columns["run_mm"], columns["run_ss"], overall_score, *scores,
+                         standards_version=standards.version)
 
-        except ValueError:
-            print("Invalid sprint drag carry seconds.")
-            flash('Invalid sprint drag carry seconds.')
-            return redirect(url_for("dashboard"))
+        return redirect(url_for("dashboard"))
 
-        try:
-            plank_m = int(request.form["plank_m"])
-            if (plank_m < 0 or plank_m > 59):
-                raise ValueError
+    elif request.method == "GET":
+        user_id = current_user.id
+        before = parse_cursor(request.args.get("before"))
+        # Only the version is read until the user's scores change
+        fragments = DASHBOARD_CACHE.get(
+            ("dashboard", user_id, get_scores_version(user_id), before),
+            lambda: render_dashboard_fragments(user_id, username, before))
+
+        # The line graph loads its points from /api/scores.
+        graph_title = "Your Scores Over Time"
+        graph_ymax = 600
+        chart = static_fragment("dashboard_chart.html", title=graph_title, max=graph_ymax)
 
-        except:
-            print("Invalid plank minutes.")
-            flash('Invalid plank minutes.')
-            return redirect(url_for("dashboard"))
+    return render_template("dashboard.html", name=current_user.name, chart=chart, **fragments)
 
-        try:
-            plank_ss = int(request.form["plank_ss"])
-            if (plank_ss < 0 or plank_ss > 59):
-                raise ValueError
 
-        except ValueError:
-            print("Invalid plank seconds.")
-            flash('Invalid plank seconds.')
-            return redirect(url_for("dashboard"))
+def render_dashboard_fragments(user_id, username, before):
+    """ Renders the dashboard fragments built from the user's ACFTs, with the units they lead. """
+    data, next_cursor = get_user_scores_page(username, before)
 
-        try:
-            run_mm = int(request.form["run_mm"])
-            if (run_mm < 0 or run_mm > 59):
-                raise ValueError
+    # Newest first, so the latest score is only on the first page
+    latest = data[0][-1] if data and before is None else None
+    if next_cursor is not None:
+        next_cursor = f"{next_cursor[0]},{next_cursor[1]}"
 
-        except ValueError:
-            print("Invalid run minutes.")
-            flash('Invalid run minutes.')
-            return redirect(url_for("dashboard"))
+    progress = get_user_progress(user_id)
+    return {"led_units": get_led_units(user_id),
+            "summary": Markup(render_template("dashboard_summary.html", latest=latest, progress=progress)),
+            "history": Markup(render_template("dashboard_history.html", data=data, next_cursor=next_cursor,
+                                              paged=before is not None))}
 
-        try:
-            run_ss = int(request.form["run_ss"])
-            if (run_ss < 0 or run_ss > 59):
-                raise ValueError
 
-        except:
-            print("Invalid run seconds.")
-            flash('Invalid run seconds.')
-            return redirect(url_for("dashboard"))
+@app.route("/api/scores")
+@login_required
+def api_scores():
+    """ Returns the logged in user's overall scores between two dates for the chart. """
+    # Downsampled to CHART_MAX_POINTS, or fewer if the points argument asks for it
+    start = request.args.get("start") or "0001-01-01"
+    end = request.args.get("end") or "9999-12-31"
+    try:
+        date.fromisoformat(start)
+        date.fromisoformat(end)
+    except ValueError:
+        return jsonify(error="Dates must be YYYY-MM-DD."), 400
+
+    max_points = app.config['CHART_MAX_POINTS']
+    max_points = max(3, min(request.args.get("points", max_points, type=int), max_points))
 
-        sdc_m = str(sdc_m)
-        sdc_ss = str(sdc_ss)
-        plank_m = str(plank_m)
-        plank_ss = str(plank_ss)
-        run_mm = str(run_mm)
-        run_ss = str(run_ss)
-
-        scores = [find_score.score_event("DL", age, gender, dl),
-                  find_score.score_event("SPT", age, gender, spt),
-                  find_score.score_event("HRP", age, gender, hrp),
-                  find_score.score_event(
-            "SDC", age, gender, f"{sdc_m}:{sdc_ss}"),
-            find_score.score_event(
-            "PLK", age, gender, f"{plank_m}:{plank_ss}"),
-            find_score.score_event(
-            "2MR", age, gender, f"{run_mm}:{run_ss}")]
+    username = current_user.username
+    labels, values = DASHBOARD_CACHE.get(
+        ("series", current_user.id, get_scores_version(current_user.id), start, end, max_points),
+        lambda: chart_series(username, start, end, max_points))
 
-        overall_score = sum(scores)
+    return jsonify(labels=labels, values=values)
 
-        print(f"{datestr} {username} {age} {gender} {dl} {spt} {hrp} {sdc_m} {sdc_ss} {plank_m} {plank_ss} {run_mm} {run_ss} {overall_score}")
 
-        add_score_record(datestr, username, age, gender, dl, spt, hrp, sdc_m,
-                         sdc_ss, plank_m, plank_ss, run_mm, run_ss, overall_score)
+def chart_series(username, start, end, max_points):
+    """ Returns the user's ACFT dates and overall scores, downsampled to max_points. """
+    series = get_user_score_series(username, start, end)
+    labels = get_user_record_dates(series)
 
-        return redirect(url_for("dashboard"))
+    # Space points by real elapsed days so the trend keeps its shape
+    return downsample.downsample_series(
+        labels, get_user_overall_scores(series), max_points,
+        positions=[date.fromisoformat(label).toordinal() for label in labels])
 
-    elif request.method == "GET":
-        data = get_user_scores(username)
 
-        print("Found " + str(len(data)) + " records.")
+@app.route("/api/plan")
+@login_required
+def api_plan():
+    """ Returns the logged in user's least effort per-event targets for a goal total. """
+    # Planned from their last ACFT against today's standards
+    goal = request.args.get("goal", PLAN_DEFAULT_GOAL, type=int)
+    if not 0 <= goal <= planner.MAX_TOTAL:
+        return jsonify(error=f"Goal must be a total from 0 to {planner.MAX_TOTAL}."), 400
+
+    last = get_last_result(current_user.id)
+    if last is None:
+        return jsonify(error="Record an ACFT first."), 404
+
+    standards = score_tables.for_date(str(date.today()))
+    with metrics.phase("scoring"):
+        targets = planner.plan(standards, current_user.age, current_user.gender, last, goal)
+    if targets is None:
+        return jsonify(error="That goal can't be reached in your age group."), 400
+    return jsonify(targets)
+
+
+@app.route("/import", methods=["POST"])
+@login_required
+def import_scores():
+    """ Imports an uploaded roster CSV of ACFT results and lists any rejected rows. """
+    roster = request.files.get("roster")
+    if roster is None:
+        return jsonify(error="No roster file uploaded."), 400
 
-        # Make line graph of user scores.
-        graph_title = "Your Scores Over Time"
+    try:
+        imported, rejected = import_roster(
+            bulk_import.decode_lines(roster.stream), importer=current_user.username)
+    except bulk_import.RosterError as error:
+        return jsonify(error=str(error), line=error.line), 400
 
-        # X axis labels are the record dates.
-        label_strings = get_user_record_dates(data)
+    return jsonify(imported=imported,
+                   rejected=[{"line": line, "error": error} for line, error in rejected])
 
-        # Y axis data is the overall user score.
-        graph_values = get_user_overall_scores(data)
-        graph_ymax = 600
 
-    return render_template("dashboard.html", name=current_user.name, data=data, title=graph_title, max=graph_ymax, labels=label_strings, values=graph_values)
+@app.route("/export")
+@login_required
+def export_scores():
+    """ Sends a leader an export of the ACFTs of soldiers in the units they lead. """
+    # format=arrow for Arrow instead of Parquet, unit=<id> for one unit and its subunits,
+    # and start and end (YYYY-MM-DD) for a date range
+    start = request.args.get("start") or None
+    end = request.args.get("end") or None
+    try:
+        for day in (start, end):
+            if day is not None:
+                date.fromisoformat(day)
+    except ValueError:
+        return jsonify(error="Dates must be YYYY-MM-DD."), 400
+    fmt = "arrow" if request.args.get("format") == "arrow" else "parquet"
+
+    with orm.db_session:
+        parents = unit_parents()
+        unit_ids = commanded_unit_ids(current_user.id, parents)
+    unit_id = request.args.get("unit", type=int)
+    if not unit_ids or (unit_id is not None and unit_id not in unit_ids):
+        abort(403)
+    if unit_id is not None:
+        unit_ids = unit_subtree(unit_id, parents)
+
+    # Spooled to disk, then streamed from there, so memory use doesn't grow with the export
+    file = tempfile.TemporaryFile()
+    try:
+        export_acfts(file, fmt, start, end, unit_ids)
+    except export.ExportUnavailable as error:
+        file.close()
+        return jsonify(error=str(error)), 501
+    except BaseException:
+        file.close()
+        raise
+    file.seek(0)
+    return send_file(file, mimetype=EXPORT_MIMETYPES[fmt], as_attachment=True,
+                     download_name=f"acft.{fmt}")
+
+
+@app.route("/unit/<int:unit_id>")
+@login_required
+@orm.db_session
+def unit_dashboard(unit_id):
+    """ Renders a leader's view of a unit and its subunits from their monthly rollups. """
+    unit = Unit.get(id=unit_id)
+    if unit is None:
+        abort(404)
+    if unit_id not in commanded_unit_ids(current_user.id, unit_parents()):
+        abort(403)
+
+    columns = ("period",) + unit_stats.ROLLUP_COLUMNS
+    periods = []
+    for rollup in orm.select(r for r in UnitRollup if r.unit == unit).order_by(
+            lambda r: orm.desc(r.period))[:UNIT_PERIODS]:
+        summary = unit_stats.summarize({column: getattr(rollup, column) for column in columns})
+        summary["period"] = rollup.period
+        periods.append(summary)
+
+    # Each subunit's totals over the same months
+    first_period = periods[-1]["period"] if periods else ""
+    subunits = []
+    for subunit in unit.subunits.select().order_by(Unit.name):
+        totals = dict.fromkeys(unit_stats.ROLLUP_COLUMNS, 0)
+        for rollup in orm.select(r for r in UnitRollup if r.unit == subunit and r.period >= first_period):
+            for column in unit_stats.ROLLUP_COLUMNS:
+                totals[column] += getattr(rollup, column)
+        subunits.append((subunit, unit_stats.summarize(totals)))
+
+    return render_template("unit.html", unit=unit, periods=periods, subunits=subunits,
+                           events=unit_stats.EVENTS, event_names=unit_stats.EVENT_NAMES)
 
 
 # Route for the login page
@@ -355,23 +1159,38 @@ def login():
     if request.method == "POST":
         username = request.form["username"]
         password = request.form["password"]
-        print(username)
-        print(password)
-        has_valid_creds = authenticate(username, password)
-        if has_valid_creds:
-            print("valid creds!")
-
-            user = orm.select(u for u in User if username ==
-                              u.username).first()
+        # Turned away before any hashing, so hash cost can't be used to tie up the server
+        attempt = (username, request.remote_addr)
+        if not ADDRESS_THROTTLE.allowed(request.remote_addr) or not ACCOUNT_THROTTLE.allowed(attempt):
+            logger.warning("Throttled login for %s from %s.", username, request.remote_addr)
+            flash('Too many login attempts, please wait a few minutes and try again')
+            return render_template("login.html"), 429
+        ADDRESS_THROTTLE.record(request.remote_addr)
+
+        try:
+            user = authenticate(username, password)
+        except auth.HashQueueFull:
+            logger.warning("Password hashing queue full, turned away login for %s.", username)
+            flash('The server is busy, please try again')
+            return render_template("login.html"), 503
+
+        if user is not None:
+            logger.info("User %s logged in.", username)
+            ACCOUNT_THROTTLE.reset(attempt)
             login_user(user)
 
             return redirect(url_for("dashboard"))
 
         else:
-            print("invalid creds!")
+            logger.info("Failed login for %s.", username)
+            ACCOUNT_THROTTLE.record(attempt)
             flash('Invalid credentials, please try again')
             error = "Invalid Credentials Error"
 
+    # Logged out with no messages waiting, the page is the same for everyone
+    elif not current_user.is_authenticated and "_flashes" not in session:
+        return static_page("login.html", 0)
+
     return render_template("login.html")
 
 
@@ -400,18 +1219,29 @@ def signup():
         password = request.form["password"]
         age_is_valid = valid_age(int(age))
         if not age_is_valid:
-            print("Invalid age!")
+            logger.debug("Signup rejected: invalid age.")
             error = "Invalid Age Error"
             flash("Error: Invalid age given. Account creation failed.")
             return redirect(url_for('signup'))
 
+        if not ADDRESS_THROTTLE.allowed(request.remote_addr):
+            logger.warning("Throttled signup from %s.", request.remote_addr)
+            flash("Error: Too many attempts, please wait a few minutes and try again.")
+            return redirect(url_for('signup'))
+        ADDRESS_THROTTLE.record(request.remote_addr)
+
         username_taken = username_exists(username)
         if not username_taken:
-            add_user(username, name, password, age, gender)
+            try:
+                add_user(username, name, password, age, gender)
+            except auth.HashQueueFull:
+                logger.warning("Password hashing queue full, turned away signup for %s.", username)
+                flash("Error: The server is busy. Account creation failed.")
+                return redirect(url_for('signup'))
 
             return redirect(url_for("login"))
         else:
-            print("Username taken!")
+            logger.debug("Signup rejected: username %s taken.", username)
             error = "Username Taken Error"
             flash("Error: Username taken. Account creation failed.")
             return redirect(url_for('signup'))
@@ -430,29 +1260,167 @@ def logout():
 @app.route('/welcome')
 def welcome():
     """ Home page that allows user to login or sign up"""
-    return render_template('welcome.html')
+    return static_page('welcome.html', app.config['STATIC_PAGE_MAX_AGE'])
+
+
+def configure_logging():
+    """ Sends log records to stderr at the ACFT_LOG_LEVEL level (INFO by default). """
+    logging.basicConfig(level=os.environ.get("ACFT_LOG_LEVEL", "INFO").upper(),
+                        format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+
+def init_db():
+    """ Migrates the database and maps the entities once per process. """
+    # Workers starting together take turns through the file lock
+    with MAPPING_LOCK:
+        if db.schema is not None:
+            return
+        with open(DB_LOCK_PATH, "a") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            for number in migrations.migrate(DB_PATH, DB_BUSY_TIMEOUT):
+                logger.info("Applied database migration %d.", number)
+            had_stats = migrations.has_table(DB_PATH, "UserStats")
+            db.generate_mapping(create_tables=True)
+            # Pony has just created the table, so fill it from any existing history
+            if not had_stats:
+                logger.info("Built soldier stats from %d ACFTs.", rebuild_user_stats())
+        # Processes forked from this one must open their own connections
+        db.disconnect()
+
+
+def on_standards_reload(registry):
+    """ Drops everything computed from the old scoring standards after a reload. """
+    find_score.SCORE_CACHE.clear()
+    CHART_PAYLOADS.clear()
+    logger.info("Loaded scoring standards %s.", ", ".join(registry.by_version))
+
+
+@orm.db_session
+def load_user_record(user_id):
+    """ Loads a User by id for the login manager, or None. """
+    return User.get(id=user_id)
 
 
 def create_app():
-    """ Initializes login manager and loads user credentials"""
+    """ Sets up the database, logins and standards watcher, returning the app unstarted. """
+    init_db()
+    if hasattr(app, "login_manager"):
+        return app
+    score_tables.watch(STANDARDS_RELOAD_INTERVAL, on_standards_reload)
+
     login_manager = LoginManager()
     login_manager.login_view = 'login'
     login_manager.init_app(app)
 
     @login_manager.user_loader
-    @orm.db_session
     def load_user(user_id):
-        return orm.select(u for u in User if user_id == u.id).first()
+        return USER_CACHE.get(int(user_id), load_user_record)
 
-    app.run()
+    if app.config['WARM_START']:
+        warm_start()
+    return app
+
+
+def warm_start():
+    """ Does the work startup otherwise leaves to the first request that needs it. """
+    # The /csv payload, the planner's inverted charts, the static pages and numpy
+    chart_payload(score_tables.current())
+    score_tables.current().targets
+    with app.test_request_context("/"):
+        for template in ("welcome.html", "login.html"):
+            static_fragment(template)
+    find_score.score_batch([25], ["M"], [200], [9.5], [40], [115], [150], [1005])
 
 
 def main():
     """ Entrypoint of program. """
-    db.generate_mapping(create_tables=True)
+    parser = argparse.ArgumentParser(description="ACFT Calculator App")
+    commands = parser.add_subparsers(dest="command")
+    import_parser = commands.add_parser(
+        "import", help="score and import a roster CSV of ACFT results")
+    import_parser.add_argument("roster", help="path to the roster CSV")
+    commands.add_parser(
+        "backfill", help="save per-event points on ACFTs recorded without them")
+    unit_parser = commands.add_parser(
+        "add-unit", help="create a unit, optionally under a parent unit and with a leader")
+    unit_parser.add_argument("name")
+    unit_parser.add_argument("--parent", help="name of the parent unit")
+    unit_parser.add_argument("--leader", help="username of the unit leader")
+    assign_parser = commands.add_parser("assign-unit", help="move a soldier into a unit")
+    assign_parser.add_argument("username")
+    assign_parser.add_argument("unit", help="name of the unit")
+    commands.add_parser(
+        "rollup", help="rebuild every unit rollup from the saved ACFTs")
+    commands.add_parser(
+        "rescore", help="rescore ACFTs against the standards in effect on their dates")
+    commands.add_parser(
+        "stats", help="rebuild every soldier's personal records and trends from the saved ACFTs")
+    export_parser = commands.add_parser(
+        "export", help="write ACFT results to a Parquet (or .arrow) file for analysis")
+    export_parser.add_argument("output", help="path of the file to write")
+    export_parser.add_argument("--start", type=validation.parse_date, help="first date, YYYY-MM-DD")
+    export_parser.add_argument("--end", type=validation.parse_date, help="last date, YYYY-MM-DD")
+    export_parser.add_argument("--unit", help="name of a unit; only its soldiers and its subunits' are exported")
+    args = parser.parse_args()
+
+    configure_logging()
+    init_db()
+
+    if args.command == "import":
+        try:
+            with open(args.roster, "rb") as file:
+                imported, rejected = import_roster(bulk_import.decode_lines(file))
+        except bulk_import.RosterError as error:
+            print(f"Nothing imported. {error}")
+            return
+        for line, error in rejected:
+            print(f"Line {line}: {error}")
+        print(f"Imported {imported} ACFTs, rejected {len(rejected)} rows.")
+        return
+
+    if args.command == "backfill":
+        print(f"Backfilled per-event points on {backfill_event_points()} ACFTs.")
+        return
+
+    if args.command == "add-unit":
+        print(add_unit(args.name, args.parent, args.leader))
+        return
+
+    if args.command == "assign-unit":
+        print(assign_unit(args.username, args.unit))
+        return
+
+    if args.command == "rollup":
+        print(f"Rebuilt unit rollups from {rebuild_rollups()} ACFTs.")
+        return
+
+    if args.command == "rescore":
+        print(f"Rescored {rescore_standards()} ACFTs.")
+        return
+
+    if args.command == "stats":
+        print(f"Rebuilt soldier stats from {rebuild_user_stats()} ACFTs.")
+        return
+
+    if args.command == "export":
+        unit_ids = None
+        if args.unit:
+            unit_ids = named_unit_ids(args.unit)
+            if unit_ids is None:
+                print(f"Unknown unit {args.unit}.")
+                return
+        try:
+            exported = export_acfts(args.output, export.format_of(args.output),
+                                    args.start, args.end, unit_ids)
+        except export.ExportUnavailable as error:
+            print(error)
+            return
+        print(f"Exported {exported} ACFTs to {args.output}.")
+        return
 
     app.secret_key = 'super secret key'
-    create_app()
+    create_app().run()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,116 @@
+"""
+startup_report.py
+
+Import-time report for server cold starts. Starts fresh Python processes
+that import server.py and build the app the way a worker does, takes the
+best of a few runs and prints where the time went, using Python's
+-X importtime. It exits with status 1 when startup goes over the budget
+or pulls in a module that is only meant to load on first use, so it can
+gate a CI step. Run from src/:
+python3 startup_report.py
+python3 startup_report.py --budget 0.5 --top 20
+"""
+
+# Imports
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+
+# Globals
+# Seconds a fresh process may take to import server and run create_app
+STARTUP_BUDGET = 0.5
+# Loaded by the first request that needs them, never at startup
+DEFERRED_MODULES = ("numpy", "pandas", "pyarrow", "cProfile", "pstats", "curses", "multiprocessing")
+STARTUP_CODE = """
+import json, sys, time
+started = time.perf_counter()
+import server
+imported = time.perf_counter()
+server.create_app()
+created = time.perf_counter()
+print(json.dumps({"import": imported - started, "create_app": created - imported,
+                  "modules": sorted(name for name in sys.modules if name.split(".")[0] in %r)}))
+""" % (DEFERRED_MODULES,)
+
+
+def parse_importtime(text):
+    """ Parses -X importtime output into (module, depth, self seconds, cumulative seconds) tuples. """
+    modules = []
+    for line in text.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        modules.append((name.strip(), depth, int(self_us) / 1e6, int(cumulative_us) / 1e6))
+    return modules
+
+
+def children_of(modules, parent):
+    """ Returns the modules a top-level module imported directly. -X importtime lists them just before it. """
+    children = []
+    for module in modules:
+        if module[1] == 0:
+            if module[0] == parent:
+                return children
+            children = []
+        elif module[1] == 1:
+            children.append(module)
+    return []
+
+
+def run_startup(db_path):
+    """ Starts one fresh process. Returns (timings dict, parsed importtime lines). """
+    env = dict(os.environ, ACFT_DB=db_path, ACFT_LOG_LEVEL="WARNING")
+    # server.py is imported from src/, wherever this was started from
+    process = subprocess.run([sys.executable, "-X", "importtime", "-c", STARTUP_CODE],
+                             capture_output=True, text=True, env=env, check=True,
+                             cwd=os.path.dirname(os.path.abspath(__file__)))
+    return json.loads(process.stdout.splitlines()[-1]), parse_importtime(process.stderr)
+
+
+def main():
+    """ Entrypoint of program. """
+    parser = argparse.ArgumentParser(description="Server startup import-time report")
+    parser.add_argument("--budget", type=float, default=STARTUP_BUDGET,
+                        help="seconds allowed for import plus create_app")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--top", type=int, default=15, help="modules to list")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as scratch:
+        db_path = os.path.join(scratch, "startup.db")
+        # The first run creates the database, which isn't part of a normal start
+        run_startup(db_path)
+        runs = [run_startup(db_path) for _ in range(args.runs)]
+    timings, modules = min(runs, key=lambda run: run[0]["import"] + run[0]["create_app"])
+    total = timings["import"] + timings["create_app"]
+
+    print(f"import server  {timings['import'] * 1000:7.1f} ms")
+    print(f"create_app()   {timings['create_app'] * 1000:7.1f} ms")
+    print(f"total          {total * 1000:7.1f} ms (budget {args.budget * 1000:.0f} ms)")
+    print()
+    print("Imported by server.py, by cumulative time:")
+    for name, _, _, cumulative in sorted(children_of(modules, "server"),
+                                         key=lambda module: -module[3])[:args.top]:
+        print(f"  {cumulative * 1000:7.1f} ms  {name}")
+    print()
+    print("Slowest modules by their own time:")
+    for name, _, self_time, _ in sorted(modules, key=lambda module: -module[2])[:args.top]:
+        print(f"  {self_time * 1000:7.1f} ms  {name}")
+
+    failed = False
+    if timings["modules"]:
+        print(f"\nLoaded at startup but meant to be deferred: {', '.join(timings['modules'])}")
+        failed = True
+    if total > args.budget:
+        print(f"\nStartup took {total * 1000:.1f} ms, over the {args.budget * 1000:.0f} ms budget.")
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,259 @@
+"""
+synthetic_data.py
+
+Seeded generator of realistic soldiers and ACFT results for load and scale
+testing. Ages and sexes follow the shape of the Army's population: mostly
+in their twenties, about one in six female. Each soldier has a fitness
+level per event, and every raw result is drawn between that soldier's
+0-point and 100-point chart values.
+
+Rows are produced one chunk at a time with numpy, scored with
+find_score.score_batch and written with one executemany per chunk, so
+memory stays flat however many rows are asked for. The same seed and
+arguments always give the same data. Run from src/:
+
+python3 synthetic_data.py db --users 50000 --acfts 10000000
+python3 synthetic_data.py csv --users 50000 --acfts 100000 roster.csv
+
+The db command adds the soldiers (soldier000001, ...) and their ACFTs to
+the server's database. The csv command writes ACFTs for the same soldiers
+as a roster for `server.py import` or /import; run `db --acfts 0` first so
+the soldiers exist.
+"""
+
+# Imports
+import argparse
+import auth
+import csv
+import sys
+import time
+from datetime import date
+import numpy as np
+import score_tables
+
+
+# Globals
+DEFAULT_SEED = 2022
+CHUNK_SIZE = 50000
+USER_CHUNK_SIZE = 10000
+# Share of soldiers in each chart age range
+AGE_RANGE_SHARES = (0.22, 0.30, 0.19, 0.13, 0.09, 0.04, 0.02, 0.007, 0.003, 0.0)
+AGE_RANGE_BOUNDS = ((17, 21), (22, 26), (27, 31), (32, 36), (37, 41),
+                    (42, 46), (47, 51), (52, 56), (57, 61), (62, 64))
+FEMALE_SHARE = 0.16
+# Fitness is where a result falls between the 0-point (0.0) and 100-point (1.0) values
+FITNESS_MEAN = 0.55
+FITNESS_SPREAD = 0.18
+TEST_NOISE = 0.06
+FIRST_DATE = date(2020, 10, 1)
+LAST_DATE = date(2024, 9, 30)
+SYNTHETIC_PASSWORD = "synthetic"
+ROSTER_COLUMNS = ("username", "date", "age", "gender", "dl", "spt", "hrp", "sdc", "plank", "run")
+
+
+def username_of(number):
+    """ Returns the username of synthetic soldier number (counting from 1). """
+    return f"soldier{number:06d}"
+
+
+def make_soldiers(users, seed):
+    """ Returns arrays of age, sex (0 for M, 1 for F) and per-event fitness for every synthetic soldier. """
+    rng = np.random.default_rng([seed, 0])
+    shares = np.array(AGE_RANGE_SHARES) / sum(AGE_RANGE_SHARES)
+    bands = rng.choice(len(shares), size=users, p=shares)
+    low = np.array([bound[0] for bound in AGE_RANGE_BOUNDS])[bands]
+    high = np.array([bound[1] for bound in AGE_RANGE_BOUNDS])[bands]
+    ages = rng.integers(low, high + 1)
+    sexes = (rng.random(users) < FEMALE_SHARE).astype(np.int64)
+    # An overall level shared by every event, plus a smaller per-event spread
+    overall = rng.normal(FITNESS_MEAN, FITNESS_SPREAD, size=(users, 1))
+    fitness = overall + rng.normal(0, FITNESS_SPREAD / 2, size=(users, len(score_tables.EVENTS)))
+    return ages, sexes, fitness
+
+
+def chart_ranges(standards):
+    """ Returns event -> array [sex, age range, (0-point value, 100-point value)] for a version of the standards. """
+    ranges = {}
+    for event in score_tables.EVENTS:
+        grid = np.zeros((len(score_tables.SEXES), len(score_tables.AGE_RANGES), 2))
+        for i, sex in enumerate(score_tables.SEXES):
+            for j, age_range in enumerate(score_tables.AGE_RANGES):
+                column = standards.get_column(event, sex, age_range)
+                # Chart order runs from the most points to the fewest
+                grid[i, j] = (column.thresholds[-1], column.thresholds[0])
+        ranges[event] = grid
+    return ranges
+
+
+def make_chunk(index, size, soldiers, ranges, seed):
+    """ Generates one chunk of raw ACFT results. Returns a dict of column arrays. """
+    ages, sexes, fitness = soldiers
+    rng = np.random.default_rng([seed, 1, index])
+    users = rng.integers(0, len(ages), size=size)
+    first = FIRST_DATE.toordinal()
+    ordinals = rng.integers(first, LAST_DATE.toordinal() + 1, size=size)
+    age_index = np.searchsorted(np.array([bound[0] for bound in AGE_RANGE_BOUNDS]),
+                                ages[users], side="right") - 1
+
+    chunk = {"user": users + 1, "ordinal": ordinals, "age": ages[users],
+             "sex": sexes[users]}
+    for e, event in enumerate(score_tables.EVENTS):
+        level = np.clip(fitness[users, e] + rng.normal(0, TEST_NOISE, size=size), 0, 1)
+        bounds = ranges[event][chunk["sex"], age_index]
+        raw = bounds[:, 0] + level * (bounds[:, 1] - bounds[:, 0])
+        if event == "SPT":
+            chunk[event] = np.round(raw, 1)
+        else:
+            chunk[event] = np.round(raw).astype(np.int64)
+    return chunk
+
+
+def chunk_dates(ordinals):
+    """ Formats date ordinals as YYYY-MM-DD strings. """
+    epoch = date(1970, 1, 1).toordinal()
+    return (np.datetime64("1970-01-01") + (ordinals - epoch)).astype(str).tolist()
+
+
+def split_time(seconds):
+    """ Splits an array of seconds into lists of minutes and seconds. """
+    return (seconds // 60).tolist(), (seconds % 60).tolist()
+
+
+def score_chunk(find_score, chunk, registry):
+    """ Scores a chunk against the standards in effect on each row's date. Returns event -> points, "total" and version lists. """
+    effective = np.array([date.fromisoformat(day).toordinal() for day in registry.effective_dates])
+    version_index = np.maximum(np.searchsorted(effective, chunk["ordinal"], side="right") - 1, 0)
+    size = len(chunk["user"])
+    scores = {key: np.zeros(size, dtype=np.int64) for key in score_tables.EVENTS + ("total",)}
+    sexes = np.array(score_tables.SEXES)[chunk["sex"]]
+    for v, standards in enumerate(registry.versions):
+        rows = version_index == v
+        if not rows.any():
+            continue
+        batch = find_score.score_batch(
+            chunk["age"][rows], sexes[rows], chunk["DL"][rows], chunk["SPT"][rows],
+            chunk["HRP"][rows], chunk["SDC"][rows], chunk["PLK"][rows], chunk["2MR"][rows],
+            standards)
+        for key, points in batch.items():
+            scores[key][rows] = points
+    versions = np.array([standards.version for standards in registry.versions])[version_index]
+    return {key: value.tolist() for key, value in scores.items()}, versions.tolist()
+
+
+def acft_rows(chunk, scores, versions, first_id):
+    """ Returns a scored chunk as Acft rows in server.ACFT_COLUMNS order. Soldier n of the chunk gets user id first_id + n - 1. """
+    sdc_m, sdc_ss = split_time(chunk["SDC"])
+    plank_m, plank_ss = split_time(chunk["PLK"])
+    run_mm, run_ss = split_time(chunk["2MR"])
+    return list(zip(chunk_dates(chunk["ordinal"]), (chunk["user"] + first_id - 1).tolist(),
+                    chunk["age"].tolist(), [score_tables.SEXES[sex] for sex in chunk["sex"].tolist()],
+                    chunk["DL"].tolist(), chunk["SPT"].tolist(), chunk["HRP"].tolist(),
+                    sdc_m, sdc_ss, plank_m, plank_ss, run_mm, run_ss, scores["total"],
+                    *(scores[event] for event in score_tables.EVENTS), versions))
+
+
+def chunk_sizes(total):
+    """ Yields (chunk index, size) pairs covering total rows. """
+    for index, start in enumerate(range(0, total, CHUNK_SIZE)):
+        yield index, min(CHUNK_SIZE, total - start)
+
+
+def write_database(users, acfts, units, seed):
+    """ Adds the synthetic soldiers, optional units and their ACFTs to the server's database. """
+    import find_score
+    import server
+    server.configure_logging()
+    server.init_db()
+    if users and server.username_exists(username_of(1)):
+        raise SystemExit("Synthetic soldiers are already in the database.")
+
+    soldiers = make_soldiers(users, seed)
+    ages, sexes, _ = soldiers
+    # Every synthetic soldier has the same password, so one hash serves them all
+    password_hash = auth.hash_password(SYNTHETIC_PASSWORD)
+    unit_ids = []
+    with server.orm.db_session:
+        if units:
+            battalion = server.Unit(name="Synthetic BN")
+            companies = [server.Unit(name=f"Synthetic CO {i + 1}", parent=battalion) for i in range(units)]
+            server.orm.flush()
+            unit_ids = [company.id for company in companies]
+        first_id = (server.db.select('SELECT MAX("id") FROM "User"')[0] or 0) + 1
+
+    for start in range(0, users, USER_CHUNK_SIZE):
+        end = min(start + USER_CHUNK_SIZE, users)
+        with server.orm.db_session:
+            server.bulk_insert(server.User, ("id", "username", "password", "name", "age", "gender", "unit"), [
+                (first_id + i, username_of(i + 1), password_hash, f"Soldier {i + 1}",
+                 int(ages[i]), score_tables.SEXES[sexes[i]],
+                 unit_ids[i % len(unit_ids)] if unit_ids else None)
+                for i in range(start, end)])
+
+    registry = score_tables.REGISTRY
+    ranges = chart_ranges(registry.current())
+    written = 0
+    started = time.perf_counter()
+    for index, size in chunk_sizes(acfts):
+        chunk = make_chunk(index, size, soldiers, ranges, seed)
+        scores, versions = score_chunk(find_score, chunk, registry)
+        with server.orm.db_session:
+            server.bulk_insert(server.Acft, server.ACFT_COLUMNS,
+                               acft_rows(chunk, scores, versions, first_id))
+        written += size
+        print(f"{written} ACFTs written ({written / (time.perf_counter() - started):.0f}/s)",
+              file=sys.stderr)
+
+    server.rebuild_user_stats()
+    if unit_ids:
+        server.rebuild_rollups()
+    return written
+
+
+def write_csv(path, users, acfts, seed):
+    """ Writes synthetic ACFTs for the synthetic soldiers as a roster CSV. """
+    soldiers = make_soldiers(users, seed)
+    ranges = chart_ranges(score_tables.current())
+    with open(path, "w", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(ROSTER_COLUMNS)
+        for index, size in chunk_sizes(acfts):
+            chunk = make_chunk(index, size, soldiers, ranges, seed)
+            times = {event: [f"{seconds // 60}:{seconds % 60:02d}" for seconds in chunk[event].tolist()]
+                     for event in ("SDC", "PLK", "2MR")}
+            writer.writerows(zip(
+                [username_of(user) for user in chunk["user"].tolist()],
+                chunk_dates(chunk["ordinal"]), chunk["age"].tolist(),
+                [score_tables.SEXES[sex] for sex in chunk["sex"].tolist()],
+                chunk["DL"].tolist(), chunk["SPT"].tolist(), chunk["HRP"].tolist(),
+                times["SDC"], times["PLK"], times["2MR"]))
+    return acfts
+
+
+def main():
+    """ Entrypoint of program. """
+    parser = argparse.ArgumentParser(description="Synthetic ACFT data generator")
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED)
+    commands = parser.add_subparsers(dest="command", required=True)
+    db_parser = commands.add_parser("db", help="add soldiers and ACFTs to the server database")
+    db_parser.add_argument("--users", type=int, required=True)
+    db_parser.add_argument("--acfts", type=int, required=True)
+    db_parser.add_argument("--units", type=int, default=0,
+                           help="spread the soldiers over this many companies of one battalion")
+    csv_parser = commands.add_parser("csv", help="write ACFTs for the synthetic soldiers as a roster CSV")
+    csv_parser.add_argument("--users", type=int, required=True)
+    csv_parser.add_argument("--acfts", type=int, required=True)
+    csv_parser.add_argument("path")
+    args = parser.parse_args()
+
+    if args.users < 1 and args.acfts:
+        parser.error("ACFTs need at least one soldier.")
+    started = time.perf_counter()
+    if args.command == "db":
+        written = write_database(args.users, args.acfts, args.units, args.seed)
+    else:
+        written = write_csv(args.path, args.users, args.acfts, args.seed)
+    print(f"Generated {args.users} soldiers and {written} ACFTs in {time.perf_counter() - started:.1f}s.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+unit_stats.py
+
+Running totals behind the leader dashboards. Every ACFT adds one set of
+counts and sums to the rollup of its soldier's unit, and of every unit
+above it, for the month it was taken. A leader's view then reads one
+precomputed rollup row per unit and month instead of every soldier's
+ACFTs.
+"""
+
+# Imports
+import score_tables
+
+
+# Globals
+EVENTS = score_tables.EVENTS
+EVENT_NAMES = {"DL": "Deadlift", "SPT": "Standing Power Throw", "HRP": "Hand Release Pushups",
+               "SDC": "Sprint Drag Carry", "PLK": "Plank", "2MR": "Run"}
+# An ACFT is passed when every event scores at least this many points.
+PASSING_EVENT_POINTS = 60
+SUM_COLUMNS = ("dl_sum", "spt_sum", "hrp_sum", "sdc_sum", "plank_sum", "run_sum")
+WEAKEST_COLUMNS = ("dl_weakest", "spt_weakest", "hrp_weakest",
+                   "sdc_weakest", "plank_weakest", "run_weakest")
+# UnitRollup counters, in the order acft_totals returns them.
+ROLLUP_COLUMNS = ("tests", "score_sum", "passed") + SUM_COLUMNS + WEAKEST_COLUMNS
+
+
+def period_of(datestr):
+    """ Returns the rollup period (YYYY-MM) of an ACFT date. """
+    return datestr[:7]
+
+
+def acft_totals(points):
+    """ Returns one ACFT's contribution to each ROLLUP_COLUMNS counter. points are the six event scores in EVENTS order. """
+    weakest = points.index(min(points))
+    passed = 1 if min(points) >= PASSING_EVENT_POINTS else 0
+    return ((1, sum(points), passed) + tuple(points)
+            + tuple(1 if i == weakest else 0 for i in range(len(points))))
+
+
+def unit_chain(unit_id, parents):
+    """ Returns unit_id followed by every unit above it. parents maps unit id -> parent id (or None). """
+    chain = []
+    while unit_id is not None and unit_id not in chain:
+        chain.append(unit_id)
+        unit_id = parents.get(unit_id)
+    return chain
+
+
+def add_acft(deltas, unit_ids, datestr, points, sign=1):
+    """ Adds one ACFT to the pending rollup deltas of each unit in unit_ids, or takes it back out with sign=-1. deltas maps (unit id, period) -> counter list. """
+    totals = acft_totals(points)
+    period = period_of(datestr)
+    for unit_id in unit_ids:
+        counters = deltas.setdefault((unit_id, period), [0] * len(ROLLUP_COLUMNS))
+        for i, value in enumerate(totals):
+            counters[i] += sign * value
+
+
+def summarize(counters):
+    """ Turns a rollup's counters (a dict keyed by ROLLUP_COLUMNS) into averages and rates for display. """
+    tests = counters["tests"]
+    if not tests:
+        return None
+    return {
+        "tests": tests,
+        "average": round(counters["score_sum"] / tests, 1),
+        "pass_rate": round(100 * counters["passed"] / tests, 1),
+        "event_averages": {event: round(counters[column] / tests, 1)
+                           for event, column in zip(EVENTS, SUM_COLUMNS)},
+        "weakest": {event: round(100 * counters[column] / tests, 1)
+                    for event, column in zip(EVENTS, WEAKEST_COLUMNS)},
+    }
@@ -0,0 +1,94 @@
+"""
+user_stats.py
+
+Running per-soldier statistics behind the progress table on the dashboard:
+personal records, the average of the latest three ACFTs and the trend of
+the total and of every event. Each ACFT updates them in constant time, so
+the dashboard reads one row per soldier instead of their whole history.
+
+Trends are least-squares slopes of points against the test date. A slope
+only needs the running sums n, sum(x), sum(x^2), sum(y) and sum(x*y), which
+a new ACFT simply adds to, so nothing is refit from the history.
+"""
+
+# Imports
+import bisect
+from datetime import date
+import unit_stats
+
+
+# Globals
+EVENTS = unit_stats.EVENTS
+# "score" is the overall score, the rest are the event points in EVENTS order
+SERIES = ("score", "dl", "spt", "hrp", "sdc", "plank", "run")
+BEST_COLUMNS = tuple(f"{series}_best" for series in SERIES)
+SUM_COLUMNS = tuple(f"{series}_sum" for series in SERIES)
+XY_SUM_COLUMNS = tuple(f"{series}_xy_sum" for series in SERIES)
+# UserStats counters, everything but the user and the recent tests.
+STATS_COLUMNS = ("tests", "x_sum", "xx_sum") + BEST_COLUMNS + SUM_COLUMNS + XY_SUM_COLUMNS
+RECENT_TESTS = 3
+# Dates are counted in days from here, keeping the sums small
+TREND_EPOCH = date(2020, 1, 1).toordinal()
+# Slopes are reported in points per this many days
+TREND_DAYS = 30
+
+
+def empty():
+    """ Returns the stats of a soldier with no ACFTs: every STATS_COLUMNS counter plus "recent". """
+    stats = dict.fromkeys(STATS_COLUMNS, 0)
+    stats["recent"] = []
+    return stats
+
+
+def day_of(datestr):
+    """ Returns the regression x of an ACFT date (YYYY-MM-DD). """
+    return date.fromisoformat(datestr).toordinal() - TREND_EPOCH
+
+
+def add_acft(stats, datestr, score, points):
+    """ Adds one ACFT to a soldier's stats in place. points are the six event scores in EVENTS order. """
+    x = day_of(datestr)
+    values = [score] + list(points)
+    stats["tests"] += 1
+    stats["x_sum"] += x
+    stats["xx_sum"] += x * x
+    for value, best, total, xy_total in zip(values, BEST_COLUMNS, SUM_COLUMNS, XY_SUM_COLUMNS):
+        stats[best] = max(stats[best], value)
+        stats[total] += value
+        stats[xy_total] += x * value
+
+    # Kept in date order; an ACFT backdated past the newest three falls off straight away
+    recent = stats["recent"]
+    position = bisect.bisect_right([entry[0] for entry in recent], datestr)
+    recent.insert(position, [datestr] + values)
+    del recent[:-RECENT_TESTS]
+
+
+def slope(stats, total, xy_total):
+    """ Returns the least-squares slope of one series in points per TREND_DAYS, or None without two test dates. """
+    n = stats["tests"]
+    denominator = n * stats["xx_sum"] - stats["x_sum"] ** 2
+    if n < 2 or denominator <= 0:
+        return None
+    return round(TREND_DAYS * (n * stats[xy_total] - stats["x_sum"] * stats[total]) / denominator, 1)
+
+
+def summarize(stats):
+    """ Turns a soldier's stats into personal records, recent averages and trends for display. """
+    tests = stats["tests"]
+    if not tests:
+        return None
+    recent = stats["recent"]
+    averages = [round(sum(entry[i + 1] for entry in recent) / len(recent), 1)
+                for i in range(len(SERIES))]
+    trends = [slope(stats, total, xy_total) for total, xy_total in zip(SUM_COLUMNS, XY_SUM_COLUMNS)]
+    bests = [stats[best] for best in BEST_COLUMNS]
+    return {
+        "tests": tests,
+        "recent_tests": len(recent),
+        "best": bests[0],
+        "recent_average": averages[0],
+        "trend": trends[0],
+        "events": [(event, unit_stats.EVENT_NAMES[event], best, average, trend)
+                   for event, best, average, trend in zip(EVENTS, bests[1:], averages[1:], trends[1:])],
+    }
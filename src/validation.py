@@ -0,0 +1,166 @@
+"""
+validation.py
+
+The one validation and normalization stage for ACFT results, shared by
+the dashboard form, roster imports and the scoring API. Each input is
+described by a Field in a schema; validate() checks a payload against the
+schema and returns typed values ready for scoring: counts as ints, the
+throw as a float and every time as a whole number of seconds.
+
+Values may arrive as form or CSV strings or as JSON numbers. Times may be
+an m:ss string, a number of seconds (JSON only) or a (minutes, seconds)
+pair, as the dashboard form sends them.
+"""
+
+# Imports
+import math
+from collections import namedtuple
+from datetime import date
+import find_score
+
+
+# Globals
+# kind is a key of PARSERS; message is the error shown when the value is invalid;
+# maximum, if set, is the largest value accepted
+Field = namedtuple("Field", ["name", "kind", "message", "maximum"], defaults=(None,))
+# Well past any real result, but small enough to score and store safely
+RESULT_FIELDS = (Field("dl", "count", "Invalid deadlift score.", 1000),
+                 Field("spt", "distance", "Invalid standing power throw.", 30.0),
+                 Field("hrp", "count", "Invalid hand release pushup score.", 300),
+                 Field("sdc", "time", "Invalid sprint drag carry time."),
+                 Field("plank", "time", "Invalid plank time."),
+                 Field("run", "time", "Invalid run time."))
+SOLDIER_FIELDS = (Field("age", "age", "Invalid age."),
+                  Field("gender", "gender", "Invalid gender."))
+DATE_FIELD = Field("date", "date", "Invalid date.")
+# Result field holding the raw score of each event, in score_tables.EVENTS order
+EVENT_FIELDS = {"DL": "dl", "SPT": "spt", "HRP": "hrp", "SDC": "sdc", "PLK": "plank", "2MR": "run"}
+# Longest time accepted for any event, 59:59
+MAX_SECONDS = 59 * 60 + 59
+# Acft columns each time is stored in, as (minutes, seconds)
+TIME_COLUMNS = {"sdc": ("sdc_m", "sdc_ss"), "plank": ("plank_m", "plank_ss"),
+                "run": ("run_mm", "run_ss")}
+# Dashboard form inputs of each result field; times are split into minutes and seconds
+FORM_INPUTS = {"dl": "deadlift", "spt": "spt", "hrp": "hrp",
+               "sdc": ("sdc_m", "sdc_ss"), "plank": ("plank_m", "plank_ss"),
+               "run": ("run_mm", "run_ss")}
+
+
+class ValidationError(ValueError):
+    """ Raised when a value fails validation. The message is fit to show the user. """
+
+
+def parse_count(value):
+    """ Parses a non-negative whole number. """
+    if isinstance(value, str):
+        value = value.strip()
+        if not value.isdigit():
+            raise ValueError(value)
+        return int(value)
+    if isinstance(value, bool) or not isinstance(value, int) or value < 0:
+        raise ValueError(value)
+    return value
+
+
+def parse_distance(value):
+    """ Parses a non-negative, finite number of meters. """
+    if isinstance(value, str):
+        value = float(value)
+    elif isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise ValueError(value)
+    if not math.isfinite(value) or value < 0:
+        raise ValueError(value)
+    return float(value)
+
+
+def parse_time(value):
+    """ Parses an m:ss string, a number of seconds or a (minutes, seconds) pair into seconds. """
+    if isinstance(value, (tuple, list)):
+        if len(value) != 2:
+            raise ValueError(value)
+        minutes, seconds = parse_count(value[0]), parse_count(value[1])
+        if seconds > 59:
+            raise ValueError(value)
+        seconds += minutes * 60
+    else:
+        seconds = find_score.convert_to_seconds(value)
+    if seconds > MAX_SECONDS:
+        raise ValueError(value)
+    return seconds
+
+
+def parse_age(value):
+    """ Parses an age within the charts' range. """
+    age = parse_count(value)
+    if age < find_score.MIN_AGE or age > find_score.MAX_AGE:
+        raise ValueError(value)
+    return age
+
+
+def parse_gender(value):
+    """ Parses M or F, in either case. """
+    if not isinstance(value, str) or value.strip().upper() not in ("M", "F"):
+        raise ValueError(value)
+    return value.strip().upper()
+
+
+def parse_date(value):
+    """ Parses a YYYY-MM-DD date, returned in the same form. """
+    if not isinstance(value, str):
+        raise ValueError(value)
+    return str(date.fromisoformat(value.strip()))
+
+
+PARSERS = {"count": parse_count, "distance": parse_distance, "time": parse_time,
+           "age": parse_age, "gender": parse_gender, "date": parse_date}
+
+
+def is_blank(value):
+    """ Returns whether a value counts as not given. """
+    if isinstance(value, str):
+        return not value.strip()
+    if isinstance(value, (tuple, list)):
+        return all(is_blank(part) for part in value)
+    return value is None
+
+
+def validate(payload, fields, optional=()):
+    """ Checks payload (a mapping) against fields and returns name -> typed value. Blank optional fields come back as None. Raises ValidationError. """
+    # A field left out entirely is missing; one sent blank, like an empty form input, is invalid
+    missing = [field.name for field in fields if payload.get(field.name) is None]
+    if missing:
+        raise ValidationError("Missing fields: " + ", ".join(missing))
+
+    values = {}
+    for field in fields + tuple(optional):
+        value = payload.get(field.name)
+        if field in optional and is_blank(value):
+            values[field.name] = None
+            continue
+        try:
+            parsed = PARSERS[field.kind](value)
+        except (ValueError, TypeError, OverflowError):
+            raise ValidationError(field.message)
+        if field.maximum is not None and parsed > field.maximum:
+            raise ValidationError(field.message)
+        values[field.name] = parsed
+    return values
+
+
+def from_form(form):
+    """ Gathers the dashboard form's inputs into a result payload for validate(). """
+    payload = {}
+    for name, inputs in FORM_INPUTS.items():
+        if isinstance(inputs, tuple):
+            payload[name] = tuple(form.get(part) for part in inputs)
+        else:
+            payload[name] = form.get(inputs)
+    return payload
+
+
+def time_columns(result):
+    """ Splits each validated time into the minutes and seconds its Acft columns store. """
+    columns = {}
+    for name, (minutes, seconds) in TIME_COLUMNS.items():
+        columns[minutes], columns[seconds] = divmod(result[name], 60)
+    return columns
@@ -0,0 +1,27 @@
+"""
+wsgi.py
+
+WSGI entry point for serving the ACFT Calculator with a pre-fork server
+instead of Flask's development server, e.g. from src/:
+gunicorn --workers 4 --bind 0.0.0.0:8000 wsgi:app
+
+Each worker migrates and maps the database when it imports this module;
+server.init_db makes the workers take turns. ACFT_SECRET_KEY is required:
+every worker signs sessions with it, and the app will not start without
+it. ACFT_LOG_LEVEL sets the log level and ACFT_PROFILE_SAMPLE_RATE the
+share of requests profiled.
+"""
+
+# Imports
+import os
+import server
+
+
+# Globals
+SECRET_KEY = os.environ.get("ACFT_SECRET_KEY")
+if not SECRET_KEY:
+    # server.py's development key is public, so anyone could forge a session with it
+    raise RuntimeError("Set ACFT_SECRET_KEY to a long random value before serving wsgi:app.")
+server.configure_logging()
+app = server.create_app()
+app.secret_key = SECRET_KEY